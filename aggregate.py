@@ -0,0 +1,119 @@
+from datetime import date
+
+from data_loader import CATEGORIES
+
+
+# same layout as the pivot tables of utils.pivot_requests: (name, row index, column index)
+SUMMARY_ANCHORS = [
+    ("category", 0, 0),
+    ("item", 0, 3),
+    ("year", 0, 6),
+    ("month", 40, 0),
+    ("month_category", 40, 6),
+]
+
+
+def summarize(table):
+    """
+    Compute the summaries of the pivot tables in a single pass over an ExpenseTable:
+    - category: expenses by category
+    - item: expenses by description
+    - year: expenses and incomes by year
+    - month: expenses and incomes by month
+    - month_category: expenses by month and category
+
+    Arguments:
+    - table (ExpenseTable): expenses
+
+    Returns:
+    - dict with the totals in cents of each summary, keyed by category code, item, year,
+      month (year * 12 + month - 1) and (month, category code)
+    """
+
+    by_category = {}
+    by_item = {}
+    by_year = {}
+    by_month = {}
+    by_month_category = {}
+
+    # month bucket of each day, the same days come back for every transaction of the day
+    months = {}
+
+    for ordinal, item, code, debit, credit in zip(table.dates, table.items, table.categories,
+                                                  table.debits, table.credits):
+
+        month = months.get(ordinal)
+        if month is None:
+            day = date.fromordinal(ordinal)
+            month = months[ordinal] = day.year * 12 + day.month - 1
+
+        by_category[code] = by_category.get(code, 0) + debit
+        by_item[item] = by_item.get(item, 0) + debit
+        by_month_category[month, code] = by_month_category.get((month, code), 0) + debit
+
+        totals = by_month.get(month)
+        if totals is None:
+            totals = by_month[month] = [0, 0]
+        totals[0] += debit
+        totals[1] += credit
+
+    # years are rolled up from the months
+    for month, (debit, credit) in by_month.items():
+        totals = by_year.setdefault(month // 12, [0, 0])
+        totals[0] += debit
+        totals[1] += credit
+
+    return {
+        "category": by_category,
+        "item": by_item,
+        "year": by_year,
+        "month": by_month,
+        "month_category": by_month_category,
+    }
+
+
+def month_label(month):
+    """
+    Convert a month index (year * 12 + month - 1) into a label like "2023-01"
+    """
+    year, month = divmod(month, 12)
+    return f"{year}-{month + 1:02d}"
+
+
+def _euros(cents):
+    return cents / 100
+
+
+def summary_values(summaries):
+    """
+    Convert the summaries into tables of values, sorted like the pivot tables
+
+    Arguments:
+    - summaries (dict): result of summarize
+
+    Returns:
+    - dict with the headers and rows of each summary
+    """
+
+    values = {}
+
+    values["category"] = [["Category", "SUM of Expenses"]] + sorted(
+        [CATEGORIES[code].value, _euros(total)] for code, total in summaries["category"].items())
+
+    values["item"] = [["Description", "SUM of Expenses"]] + sorted(
+        [item, _euros(total)] for item, total in summaries["item"].items())
+
+    values["year"] = [["Year", "SUM of Expenses", "SUM of Incomes"]] + [
+        [year, _euros(debit), _euros(credit)] for year, (debit, credit) in sorted(summaries["year"].items())]
+
+    values["month"] = [["Month", "SUM of Expenses", "SUM of Incomes"]] + [
+        [month_label(month), _euros(debit), _euros(credit)]
+        for month, (debit, credit) in sorted(summaries["month"].items())]
+
+    # months in rows, categories in columns
+    codes = sorted({code for _, code in summaries["month_category"]}, key=lambda code: CATEGORIES[code].value)
+    values["month_category"] = [["Month"] + [CATEGORIES[code].value for code in codes]] + [
+        [month_label(month)] + [_euros(summaries["month_category"].get((month, code), 0)) for code in codes]
+        for month in sorted(summaries["month"])]
+
+    return values
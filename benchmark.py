@@ -0,0 +1,119 @@
+from fake_sheets import FakeSheetsService
+from data_loader import HEADERS
+from utils import create_sheet, update_values, format_cells, create_pivot_tables
+
+from datetime import date, timedelta
+import argparse
+import json
+import random
+import time
+
+
+ITEMS = ["Restaurant", "Groceries", "Insurance", "Bar", "Subway", "Rent", "Salary", "Electricity",
+         "Netflix subscription", "Car repair", "Shopping", "Holidays", "Tax", "Other"]
+
+
+def generate_data(rows, seed=0):
+    """
+    Generate headers and rows sorted by date, like the output of get_data
+
+    Arguments:
+    - rows (int): number of rows
+    - seed (int): seed of the random generator
+
+    Returns:
+    - list with the headers and the rows
+    """
+
+    generator = random.Random(seed)
+    first_day = date(2010, 1, 1)
+
+    data = [HEADERS]
+    for index in range(rows):
+        day = first_day + timedelta(days=index * 3650 // max(rows, 1))
+        item = generator.choice(ITEMS)
+        amount = f"{generator.randint(1, 50000) // 100},{generator.randint(0, 99):02d}"
+        if item == "Salary":
+            data.append([day.strftime("%d/%m/%Y"), item, "Income", "", amount])
+        else:
+            data.append([day.strftime("%d/%m/%Y"), item, "Other", amount, ""])
+
+    return data
+
+
+def run(rows, latency=0.0, error_rate=0.0, workers=4):
+    """
+    Time create_sheet, update_values, format_cells and create_pivot_tables against the fake service
+
+    Arguments:
+    - rows (int): number of rows of the data
+    - latency (float): seconds waited by each request
+    - error_rate (float): probability of a request to fail with a 429
+    - workers (int): number of concurrent uploads of update_values
+
+    Returns:
+    - list with the request count, bytes sent and received, injected errors and wall time of each phase
+    """
+
+    data = generate_data(rows)
+    service = FakeSheetsService(latency=latency, error_rate=error_rate)
+    spreadsheet_id = None
+
+    def create():
+        nonlocal spreadsheet_id
+        spreadsheet_id = create_sheet(service)["spreadsheetId"]
+
+    phases = [
+        ("create_sheet", create),
+        ("update_values", lambda: update_values(service, spreadsheet_id, data, workers=workers)),
+        ("format_cells", lambda: format_cells(service, spreadsheet_id)),
+        ("create_pivot_tables", lambda: create_pivot_tables(service, spreadsheet_id, data)),
+    ]
+
+    results = []
+    for name, phase in phases:
+        service.reset_stats()
+        start = time.perf_counter()
+        phase()
+        results.append(dict(phase=name, rows=rows, seconds=time.perf_counter() - start, **service.stats))
+
+    return results
+
+
+def add_arguments(parser):
+    """
+    Add the options of the benchmark to a command line parser, shared with cli.py
+
+    Arguments:
+    - parser (argparse.ArgumentParser): parser of the command
+    """
+
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000], help="sizes of the data")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds waited by each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 429 error")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--json", action="store_true", help="print the results as json lines")
+
+
+def main(args):
+    """
+    Run the benchmark with the parsed command line options, see add_arguments
+    """
+
+    for rows in args.rows:
+        for result in run(rows, args.latency, args.error_rate, args.workers):
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['rows']:>9} rows  {result['phase']:<20} {result['seconds']:8.3f}s "
+                      f"{result['requests']:>5} requests  {result['bytes_sent']:>12} bytes sent  "
+                      f"{result['errors']:>3} errors")
+
+
+if __name__ == "__main__":
+
+    # command line arguments
+    parser = argparse.ArgumentParser(description="Benchmark the google sheets updates against a fake service")
+    add_arguments(parser)
+
+    main(parser.parse_args())
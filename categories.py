@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import re
+from enum import Enum
+
+
+class CATEGORY(Enum):
+    HOUSING = "Housing"
+    ENTERTAINMENT = "Entertainment"
+    SHOPPING = "Shopping"
+    FOOD = "Food"
+    INSURANCE = "Insurance"
+    UTILITIES = "Utilities"
+    TRANSPORTATION = "Transportation"
+    PERSONAL = "Personal"
+    DEBT = "Debt"
+    INCOME = "Income"
+    OTHER = "Other"
+    SUBSCRIPTION = "Subscription"
+    HOLIDAYS = "Holidays"
+    TAX = "Tax"
+
+
+# rules in priority order: the first rule matching an item gives its category
+# - exact: items equal to one of the keywords
+# - contains: items containing one of the keywords
+DEFAULT_RULES = [
+    {"category": "Utilities", "exact": ["water", "electricity", "phone", "internet"]},
+    {"category": "Transportation", "exact": ["train", "subway"], "contains": ["car"]},
+    {"category": "Entertainment", "exact": ["bar", "entertainment"]},
+    {"category": "Food", "exact": ["groceries", "restaurant"]},
+    {"category": "Income", "exact": ["salary", "income", "transfer"]},
+    {"category": "Subscription", "contains": ["subscription"]},
+    {"category": "Housing", "exact": ["rent"]},
+    {"category": "Tax", "exact": ["tax", "contribution"]},
+    {"category": "Insurance", "exact": ["insurance"]},
+    {"category": "Holidays", "exact": ["holidays"]},
+    {"category": "Shopping", "exact": ["shopping"]},
+    {"category": "Debt", "exact": ["repayment", "debt"]},
+    {"category": "Other", "exact": ["other"]},
+]
+
+# json file with custom rules, same format as DEFAULT_RULES
+CATEGORIES_FILE = "categories.json"
+
+
+class CategoryRules():
+    """
+    Categorization rules compiled once into an exact-match index and a single
+    substring regex, with the results cached per distinct description.
+    The fingerprint identifies the version of the rules, see parse_cache.py
+    """
+
+    def __init__(self, rules, default=CATEGORY.OTHER):
+        self.default = default
+        self.exact = {}
+        self.priorities = {}
+        self.cache = {}
+
+        # the same rules in the same order give the same categories
+        content = json.dumps([rules, default.value], sort_keys=True)
+        self.fingerprint = hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+        patterns = []
+        for priority, rule in enumerate(rules):
+            category = CATEGORY(rule["category"])
+
+            # keep the highest priority rule of a keyword
+            for keyword in rule.get("exact", []):
+                self.exact.setdefault(keyword.lower(), (priority, category))
+
+            for keyword in rule.get("contains", []):
+                keyword = keyword.lower()
+                if keyword not in self.priorities:
+                    self.priorities[keyword] = (priority, category)
+                    patterns.append(keyword)
+
+        # the lookahead finds the matches at every position, overlapping ones included,
+        # and the alternatives are ordered by priority
+        self.matcher = None
+        if patterns:
+            alternatives = "|".join(re.escape(keyword) for keyword in patterns)
+            self.matcher = re.compile(f"(?=({alternatives}))")
+
+    def match(self, item):
+        """
+        Find the category of a normalized item without the cache
+
+        Arguments:
+        - item (str): lowercase and stripped description
+
+        Returns:
+        - CATEGORY of the highest priority matching rule, default category otherwise
+        """
+
+        candidates = []
+
+        if item in self.exact:
+            candidates.append(self.exact[item])
+
+        if self.matcher is not None:
+            candidates.extend(self.priorities[keyword] for keyword in self.matcher.findall(item))
+
+        if not candidates:
+            return self.default
+
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    def categorize(self, item):
+        """
+        Find the category of a description
+
+        Arguments:
+        - item (str): description of the transaction
+
+        Returns:
+        - CATEGORY of the description
+        """
+
+        try:
+            return self.cache[item]
+        except KeyError:
+            category = self.cache[item] = self.match(item.lower().strip())
+            return category
+
+
+def load_rules(file=CATEGORIES_FILE):
+    """
+    Load the categorization rules from a json file, or the default rules if it doesn't exist
+
+    Arguments:
+    - file (str): json file with a list of rules like DEFAULT_RULES
+
+    Returns:
+    - CategoryRules
+    """
+
+    if not os.path.exists(file):
+        return CategoryRules(DEFAULT_RULES)
+
+    with open(file) as rules_file:
+        return CategoryRules(json.load(rules_file))
+
+
+_rules = None
+
+
+def get_rules():
+    """
+    Get the categorization rules of the process, loaded on first use
+
+    Returns:
+    - CategoryRules
+    """
+    global _rules
+
+    if _rules is None:
+        _rules = load_rules()
+
+    return _rules
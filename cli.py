@@ -0,0 +1,192 @@
+import argparse
+import os
+import subprocess
+import sys
+
+
+# seconds allowed to import the modules of the local-only commands, see check_import_time
+IMPORT_BUDGET = 0.5
+
+# modules of the local-only commands, and the heavy ones they must never load
+LOCAL_MODULES = ["update_sheets", "aggregate", "ledger"]
+HEAVY_MODULES = ["tkinter", "googleapiclient", "google_auth_oauthlib", "google_auth_httplib2", "google.oauth2",
+                 "httplib2"]
+
+
+def check_import_time(modules=LOCAL_MODULES, budget=IMPORT_BUDGET):
+    """
+    Import modules in a fresh interpreter with python -X importtime, and check they load
+    within a time budget and without any heavy module
+
+    Arguments:
+    - modules (list): modules to import
+    - budget (float): maximum import time in seconds
+
+    Returns:
+    - dict with the import time in seconds, the heavy modules which were loaded,
+      the slowest imports and ok if the budget is met
+    """
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+
+    # lines like "import time:  self [us] | cumulative | imported package", nested imports are indented
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, package = line.split("|")
+        imports.append((package[1:].rstrip(), int(cumulative)))
+
+    seconds = sum(cumulative for package, cumulative in imports if not package.startswith(" ")) / 1e6
+    loaded = {package.strip() for package, _ in imports}
+    heavy = sorted(module for module in HEAVY_MODULES if module in loaded)
+    slowest = sorted(((package.strip(), cumulative / 1e6) for package, cumulative in imports
+                      if not package.startswith(" ")), key=lambda item: -item[1])[:5]
+
+    return {"seconds": seconds, "heavy": heavy, "slowest": slowest, "ok": seconds <= budget and not heavy}
+
+
+def _print_table(rows):
+    widths = [max(len(str(row[column])) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(f"{value:>{width}}" if isinstance(value, (int, float)) else f"{value:<{width}}"
+                        for value, width in zip(row, widths)))
+    print()
+
+
+def create(args):
+    import create_sheet
+    create_sheet.main(args)
+
+
+def sync(args):
+    import update_sheets
+    update_sheets.main(args)
+
+
+def report(args):
+    """
+    Print the expenses by category and the expenses and incomes by month, without network
+    """
+
+    if args.ledger:
+        from ledger import Ledger
+
+        with Ledger() as ledger:
+            totals = ledger.monthly_totals(args.category, args.year)
+
+        _print_table([["Month", "Expenses", "Incomes"]] +
+                     [[month, debit / 100, credit / 100] for month, debit, credit in totals])
+        return
+
+    from aggregate import summarize, summary_values
+    from categories import CATEGORY
+    from data_loader import ExpenseTable
+    from parse_cache import ParseCache
+    from update_sheets import load_data
+    from datetime import date
+    import json
+
+    sources = None
+    if args.sources:
+        with open(args.sources) as file:
+            sources = json.load(file)
+
+    cache = None if args.no_cache else ParseCache()
+    data = load_data(args.input, sources, typed=True, dedup=args.dedup, cache=cache, verbose=False)
+    table = ExpenseTable.from_values(data)
+    if args.category or args.year:
+        category = CATEGORY(args.category) if args.category else None
+        start = date(args.year, 1, 1) if args.year else None
+        end = date(args.year, 12, 31) if args.year else None
+        table = table.filter(category, start, end)
+
+    values = summary_values(summarize(table))
+    _print_table(values["category"])
+    _print_table(values["month"])
+
+
+def bench(args):
+    if args.import_time:
+        result = check_import_time(budget=args.budget)
+        print(f"import time {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+        for package, seconds in result["slowest"]:
+            print(f"  {package:<20} {seconds:.3f}s")
+        if result["heavy"]:
+            print(f"heavy modules loaded: {', '.join(result['heavy'])}")
+        sys.exit(0 if result["ok"] else 1)
+
+    import benchmark
+    benchmark.main(args)
+
+
+def _bench_arguments(parser):
+    parser.add_argument("--import-time", action="store_true",
+                        help="check the import time of the local-only commands, exit 1 over the budget")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="import time budget in seconds")
+
+
+def main(argv=None):
+    """
+    Single entry point of the commands: create, sync, report and bench.
+    The modules of a command are imported when it runs, the local-only commands
+    never load the google client.
+    """
+
+    parser = argparse.ArgumentParser(description="Expenses in google sheets")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # the options of the existing scripts are reused, their modules are only imported to run the command
+    parser_create = commands.add_parser("create", help="create the google sheets of the expenses", add_help=False)
+    parser_create.set_defaults(run=create)
+
+    parser_sync = commands.add_parser("sync", help="update the google sheets with the expenses", add_help=False)
+    parser_sync.set_defaults(run=sync)
+
+    parser_report = commands.add_parser("report", help="print the summaries of the expenses, without network")
+    parser_report.add_argument("--input", default="expenses.csv", help="csv file, directory or glob pattern")
+    parser_report.add_argument("--sources", help="json file with the csv formats keyed by glob pattern")
+    parser_report.add_argument("--dedup", action="store_true", help="drop the transactions repeated by exports")
+    parser_report.add_argument("--no-cache", action="store_true", help="parse all the csv files again")
+    parser_report.add_argument("--ledger", action="store_true", help="read the local ledger instead of the csv files")
+    parser_report.add_argument("--category", help="only the expenses of a category")
+    parser_report.add_argument("--year", type=int, help="only the expenses of a year")
+    parser_report.set_defaults(run=report)
+
+    parser_bench = commands.add_parser("bench", help="benchmark the updates against a fake service", add_help=False)
+    _bench_arguments(parser_bench)
+    parser_bench.set_defaults(run=bench)
+
+    args, rest = parser.parse_known_args(argv)
+
+    # the options of create, sync and bench are declared by their modules
+    if args.command == "create":
+        import create_sheet
+        parser_create = argparse.ArgumentParser(prog="cli.py create", description="Create the google sheets")
+        create_sheet.add_arguments(parser_create)
+        args = parser_create.parse_args(rest, args)
+
+    elif args.command == "sync":
+        import update_sheets
+        parser_sync = argparse.ArgumentParser(prog="cli.py sync", description="Update the google sheets")
+        update_sheets.add_arguments(parser_sync)
+        args = parser_sync.parse_args(rest, args)
+
+    elif args.command == "bench" and not args.import_time:
+        import benchmark
+        parser_bench = argparse.ArgumentParser(prog="cli.py bench", description="Benchmark the updates")
+        _bench_arguments(parser_bench)
+        benchmark.add_arguments(parser_bench)
+        args = parser_bench.parse_args(rest, args)
+
+    elif rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
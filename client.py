@@ -0,0 +1,151 @@
+# google libraries
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+
+from datetime import datetime, timezone
+import gzip
+import os
+import threading
+
+from utils import SCOPES, GZIP_MIN_BYTES, REFRESH_MARGIN, HTTP_TIMEOUT
+
+
+class GzipHttp(httplib2.Http):
+    """
+    Http object compressing the request bodies with gzip
+    """
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        if body is not None and len(body) >= GZIP_MIN_BYTES:
+            if isinstance(body, str):
+                body = body.encode()
+            body = gzip.compress(body)
+            headers = dict(headers or {})
+            headers["content-encoding"] = "gzip"
+            headers["content-length"] = str(len(body))
+
+        return super().request(uri, method, body, headers, *args, **kwargs)
+
+
+def _new_http(compress=False):
+    """
+    Create an http object keeping its connections alive
+
+    Arguments:
+    - compress (bool): gzip the request bodies
+
+    Returns:
+    - httplib2.Http
+    """
+    http_class = GzipHttp if compress else httplib2.Http
+    return http_class(timeout=HTTP_TIMEOUT)
+
+
+def _save_credentials(creds, token_file):
+    with open(token_file, "w") as token:
+        token.write(creds.to_json())
+
+
+def _refresh_before_expiry(creds, token_file):
+    """
+    Refresh the credentials in a background thread REFRESH_MARGIN seconds before they expire
+
+    Arguments:
+    - creds: google credentials
+    - token_file (str): file where the refreshed credentials are saved
+    """
+
+    if not creds.expiry or not creds.refresh_token:
+        return
+
+    def refresh():
+        try:
+            creds.refresh(Request())
+            _save_credentials(creds, token_file)
+        except Exception as err:
+            # the next request refreshes the credentials itself
+            print(err)
+            return
+        _refresh_before_expiry(creds, token_file)
+
+    # expiry is a naive utc datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    delay = (creds.expiry - now).total_seconds() - REFRESH_MARGIN
+    timer = threading.Timer(max(delay, 0), refresh)
+    timer.daemon = True
+    timer.start()
+
+
+def build_service(token_file, credentials_file, compress=False):
+    """
+    Authorize with a personal credentials.json file and build the google sheets service,
+    see utils.create_authorized_service which caches the services of the process
+
+    Arguments:
+    - token_file (str): file with the access and refresh tokens
+    - credentials_file (str): credentials of the google cloud project
+    - compress (bool): gzip the request bodies
+
+    Returns:
+    - service: Google Sheets service, None if it couldn't be built
+    """
+
+    creds = None
+
+    # The file token.json stores the user's access and refresh tokens
+    # It is created automatically when the authorization flow completes for the first time
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+
+    # Check if there are no credentials available
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, SCOPES)
+            creds = flow.run_local_server(port=0)
+
+        # save the credentials for the next run
+        _save_credentials(creds, token_file)
+
+    # refresh the token before it expires, off the requests path
+    _refresh_before_expiry(creds, token_file)
+
+    try:
+        # create sheets service, the http connection is kept alive between requests,
+        # the discovery document is the one bundled with googleapiclient, nothing is downloaded
+        service = build("sheets", "v4", http=authorized_http(creds, compress))
+
+        # console log for the user
+        print("Sheets service created successfully")
+
+        return service
+
+    except HttpError as err:
+        print(err)
+
+
+def authorized_http(credentials, compress=False):
+    """
+    Create an authorized http object keeping its connections alive
+
+    Arguments:
+    - credentials: google credentials
+    - compress (bool): gzip the request bodies
+
+    Returns:
+    - AuthorizedHttp
+    """
+    return AuthorizedHttp(credentials, http=_new_http(compress))
+
+
+def is_compressed(service):
+    """
+    Check if a service gzips its request bodies
+    """
+    return isinstance(getattr(service._http, "http", None), GzipHttp)
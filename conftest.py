@@ -0,0 +1,23 @@
+from fake_sheets import FakeSheetsService
+from utils import create_sheet
+
+import pytest
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # the local state files (manifest, ledger, dashboard...) are written in a temporary directory
+    monkeypatch.chdir(tmp_path)
+    return FakeSheetsService()
+
+
+@pytest.fixture
+def spreadsheet_id(service):
+    return create_sheet(service)["spreadsheetId"]
+
+
+def sheet_rows(service, spreadsheet_id, title="data"):
+    """
+    Non empty rows of a sheet of the fake service
+    """
+    return [row for row in service.sheet(spreadsheet_id, title)["values"] if any(value != "" for value in row)]
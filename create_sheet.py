@@ -1,11 +1,35 @@
 from utils import create_authorized_service, create_sheet
+import argparse
+
+
+def add_arguments(parser):
+    """
+    Add the options of the sheet creation to a command line parser, shared with cli.py
+
+    Arguments:
+    - parser (argparse.ArgumentParser): parser of the command
+    """
+
+    parser.add_argument("--sharded", action="store_true",
+                        help="one data and pivot tables tab per year, added on demand by update_sheets.py --sharded")
+
+
+def main(args):
+    """
+    Create the google sheets with the parsed command line options, see add_arguments
+    """
 
-if __name__ == "__main__":
-    
     # create google sheets service
     service = create_authorized_service()
 
     # create a new google sheet
-    create_sheet(service)
+    create_sheet(service, args.sharded)
+
+
+if __name__ == "__main__":
 
+    # command line arguments
+    parser = argparse.ArgumentParser(description="Create the google sheets of the expenses")
+    add_arguments(parser)
 
+    main(parser.parse_args())
@@ -0,0 +1,278 @@
+from categories import CATEGORY
+from data_loader import amount_cents, month_index
+from aggregate import month_label
+from utils import BatchBuilder, to_cell
+
+import json
+import os
+
+
+# totals of the dashboard and months waiting to be written, per spreadsheet
+DASHBOARD_FILE = "dashboard.json"
+
+# dashboard tab of create_sheet, and id of its chart
+DASHBOARD_SHEET_ID = 0
+CHART_ID = 1000
+
+# one row per month, from the first month of the data: the totals, then the expenses of each category
+EXPENSE_CATEGORIES = [category.value for category in CATEGORY if category is not CATEGORY.INCOME]
+DASHBOARD_HEADERS = ["Month", "Expenses", "Incomes", "Balance"] + EXPENSE_CATEGORIES
+
+
+def row_totals(row):
+    """
+    Month, category and amounts of a row of get_data, with a typed or a dd/mm/yyyy date
+
+    Returns:
+    - month index, category value, expenses in cents, incomes in cents
+    """
+
+    return month_index(row[0]), row[2], amount_cents(row[3]), amount_cents(row[4])
+
+
+def _new_totals():
+    return {"expenses": 0, "incomes": 0, "categories": {}}
+
+
+class Dashboard():
+    """
+    Totals of the dashboard tab: expenses, incomes, balance and expenses by category of each month.
+    The totals are updated as the rows are ingested and the months they change are marked dirty,
+    so a refresh rewrites only the rows of these months and the source range of the chart.
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - dashboard_file (str): json file of the dashboard states
+    """
+
+    def __init__(self, spreadsheet_id, dashboard_file=DASHBOARD_FILE):
+        self.spreadsheet_id = spreadsheet_id
+        self.dashboard_file = dashboard_file
+
+        state = {}
+        if os.path.exists(dashboard_file):
+            with open(dashboard_file) as file:
+                state = json.load(file).get(spreadsheet_id, {})
+
+        self.months = {int(month): totals for month, totals in state.get("months", {}).items()}
+        self.dirty = set(state.get("dirty", []))
+
+        # months of the first and last rows of the tab, the layout only grows
+        self.first = state.get("first")
+        self.last = state.get("last")
+
+        # number of rows covered by the chart, 0 before the first refresh
+        self.chart_rows = state.get("chart_rows", 0)
+
+    def save(self):
+        """
+        Save the state of the dashboard
+        """
+
+        states = {}
+        if os.path.exists(self.dashboard_file):
+            with open(self.dashboard_file) as file:
+                states = json.load(file)
+
+        states[self.spreadsheet_id] = {
+            "months": {str(month): totals for month, totals in sorted(self.months.items())},
+            "dirty": sorted(self.dirty),
+            "first": self.first,
+            "last": self.last,
+            "chart_rows": self.chart_rows,
+        }
+
+        with open(self.dashboard_file + ".tmp", "w") as file:
+            json.dump(states, file, indent=2)
+        os.replace(self.dashboard_file + ".tmp", self.dashboard_file)
+
+    def _extend(self, month):
+        if self.first is None:
+            self.first = self.last = month
+            return
+
+        # the rows move down, every month is written again
+        if month < self.first:
+            self.dirty.update(range(month, self.last + 1))
+            self.first = month
+
+        # the months between the last one and the new one get empty rows
+        if month > self.last:
+            self.dirty.update(range(self.last + 1, month))
+            self.last = month
+
+    def add(self, rows):
+        """
+        Add new transactions to the totals
+
+        Arguments:
+        - rows (iterable): rows of get_data without the headers, typed or not
+        """
+
+        for row in rows:
+            month, category, debit, credit = row_totals(row)
+            self._extend(month)
+
+            totals = self.months.get(month)
+            if totals is None:
+                totals = self.months[month] = _new_totals()
+
+            totals["expenses"] += debit
+            totals["incomes"] += credit
+            if debit:
+                totals["categories"][category] = totals["categories"].get(category, 0) + debit
+
+            self.dirty.add(month)
+
+    def replace(self, data):
+        """
+        Compute the totals of the whole data again, only the months whose totals changed are marked dirty
+
+        Arguments:
+        - data (list): headers and rows of get_data, typed or not
+        """
+
+        previous, first, last, dirty = self.months, self.first, self.last, self.dirty
+        self.months = {}
+        self.dirty = set()
+        self.add(data[1:])
+
+        # add marked every month of the data, only the changes matter,
+        # and the months which have no transaction anymore are written with empty totals
+        dirty.update(month for month, totals in self.months.items() if previous.get(month) != totals)
+        dirty.update(month for month in previous if month not in self.months)
+
+        # no rows and no saved layout, nothing to write
+        if self.first is None:
+            self.dirty = dirty
+            return
+
+        # new rows of the layout
+        if first is None or self.first < first:
+            dirty.update(range(self.first, self.last + 1))
+        elif self.last > last:
+            dirty.update(range(last + 1, self.last + 1))
+
+        self.dirty = dirty
+
+    def _row(self, month):
+        totals = self.months.get(month) or _new_totals()
+        categories = totals["categories"]
+
+        return [month_label(month),
+                totals["expenses"] / 100,
+                totals["incomes"] / 100,
+                (totals["incomes"] - totals["expenses"]) / 100] + \
+            [categories.get(category, 0) / 100 for category in EXPENSE_CATEGORIES]
+
+    def _chart_spec(self, rows_count):
+        def source(column):
+            return {"sourceRange": {"sources": [{
+                "sheetId": DASHBOARD_SHEET_ID,
+                "startRowIndex": 0,
+                "endRowIndex": rows_count,
+                "startColumnIndex": column,
+                "endColumnIndex": column + 1
+            }]}}
+
+        return {
+            "title": "Expenses and incomes by month",
+            "basicChart": {
+                "chartType": "COLUMN",
+                "legendPosition": "BOTTOM_LEGEND",
+                "headerCount": 1,
+                "axis": [
+                    {"position": "BOTTOM_AXIS", "title": "Month"},
+                    {"position": "LEFT_AXIS", "title": "Amount"}
+                ],
+                "domains": [{"domain": source(0)}],
+                "series": [{"series": source(1), "targetAxis": "LEFT_AXIS"},
+                           {"series": source(2), "targetAxis": "LEFT_AXIS"}]
+            }
+        }
+
+    def requests(self):
+        """
+        Requests writing the rows of the dirty months, the headers and the chart the first time,
+        and the source range of the chart when months were added
+
+        Returns:
+        - list of requests of a spreadsheets().batchUpdate
+        """
+
+        if self.first is None:
+            return []
+
+        requests = []
+        rows_count = self.last - self.first + 2
+
+        if self.chart_rows == 0:
+            requests.append({
+                "updateCells": {
+                    "rows": [{"values": [to_cell(value) for value in DASHBOARD_HEADERS]}],
+                    "start": {"sheetId": DASHBOARD_SHEET_ID, "rowIndex": 0, "columnIndex": 0},
+                    "fields": "userEnteredValue"
+                }
+            })
+
+        # one request per run of consecutive dirty months
+        runs = []
+        for month in sorted(self.dirty):
+            if runs and runs[-1][-1] == month - 1:
+                runs[-1].append(month)
+            else:
+                runs.append([month])
+
+        for months in runs:
+            requests.append({
+                "updateCells": {
+                    "rows": [{"values": [to_cell(value) for value in self._row(month)]} for month in months],
+                    "start": {"sheetId": DASHBOARD_SHEET_ID, "rowIndex": months[0] - self.first + 1, "columnIndex": 0},
+                    "fields": "userEnteredValue"
+                }
+            })
+
+        if self.chart_rows == 0:
+            requests.append({
+                "addChart": {
+                    "chart": {
+                        "chartId": CHART_ID,
+                        "spec": self._chart_spec(rows_count),
+                        "position": {"overlayPosition": {"anchorCell": {
+                            "sheetId": DASHBOARD_SHEET_ID,
+                            "rowIndex": 0,
+                            "columnIndex": len(DASHBOARD_HEADERS) + 1
+                        }}}
+                    }
+                }
+            })
+        elif self.chart_rows != rows_count:
+            requests.append({"updateChartSpec": {"chartId": CHART_ID, "spec": self._chart_spec(rows_count)}})
+
+        return requests
+
+    def refresh(self, service):
+        """
+        Write the dirty months and the chart range in a single batchUpdate, then save the state
+
+        Arguments:
+        - service : google sheets service
+
+        Returns:
+        - number of written months
+        """
+
+        written = len(self.dirty)
+
+        requests = self.requests()
+        if requests:
+            batch = BatchBuilder(service, self.spreadsheet_id)
+            batch.add(requests)
+            batch.flush()
+
+            self.chart_rows = self.last - self.first + 2
+
+        self.dirty = set()
+        self.save()
+
+        return written
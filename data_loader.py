@@ -1,25 +1,22 @@
 
 import csv
-from enum import Enum
-from datetime import datetime
-from tkinter import E
-
-
-class CATEGORY(Enum):
-    HOUSING = "Housing"
-    ENTERTAINMENT = "Entertainment"
-    SHOPPING = "Shopping"
-    FOOD = "Food"
-    INSURANCE = "Insurance"
-    UTILITIES = "Utilities"
-    TRANSPORTATION = "Transportation"
-    PERSONAL = "Personal"
-    DEBT = "Debt"
-    INCOME = "Income"
-    OTHER = "Other"
-    SUBSCRIPTION = "Subscription"
-    HOLIDAYS = "Holidays"
-    TAX = "Tax"
+import glob
+import heapq
+import os
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+from fnmatch import fnmatch
+from itertools import compress, islice, repeat
+from operator import itemgetter
+
+from categories import CATEGORY, get_rules
+from metrics import span
+import metrics
 
 
 class Expense():
@@ -32,83 +29,749 @@ class Expense():
         self.category = self.determine_category()
 
     def determine_category(self):
+        return get_rules().categorize(self.item)
+
+
+HEADERS = ["Date","Description","Category","Expenses", "Incomes"]
+DATE_FORMAT = "%d/%m/%Y"
+
+# csv format of the bank exports: delimiter, columns of the date, item, debit and credit, date format,
+# and account of the transactions for the dedup
+DEFAULT_SOURCE = {"delimiter": ";", "columns": [0, 1, 2, 3], "date_format": DATE_FORMAT, "source": ""}
+
+# day 0 of the google sheets dates
+SERIAL_EPOCH = date(1899, 12, 30).toordinal()
+
+
+def parse_date(row):
+    """
+    Parse the date of a csv row, used as sort key
+
+    Arguments:
+    - row (list): csv row whose first column is a dd/mm/yyyy date
+
+    Returns:
+    - datetime of the row
+    """
+    return datetime.strptime(row[0], DATE_FORMAT)
+
 
-        item = self.item.lower().strip()
-
-        if item in ["water", "electricity","phone", "internet"]:
-            return CATEGORY.UTILITIES
-        elif item in ["train", "subway"] or "car" in item:
-            return CATEGORY.TRANSPORTATION
-        elif item in ["bar", "entertainment"]:
-            return CATEGORY.ENTERTAINMENT
-        elif item in ["groceries", "restaurant"]:
-            return CATEGORY.FOOD
-        elif item in ["salary","income","transfer"]:
-            return CATEGORY.INCOME
-        elif "subscription" in item:
-            return CATEGORY.SUBSCRIPTION
-        elif item == "rent":
-            return CATEGORY.HOUSING
-        elif item in ["tax", "contribution"]:
-            return CATEGORY.TAX
-        elif item == "insurance":
-            return CATEGORY.INSURANCE
-        elif item == "holidays":
-            return CATEGORY.HOLIDAYS
-        elif item == "shopping":
-            return CATEGORY.SHOPPING
-        elif item in ["repayment", "debt"]:
-            return CATEGORY.DEBT
-        elif item == "other":
-            return CATEGORY.OTHER
-
-
-def get_data(file):
+def read_rows(file, delimiter=";"):
+    """
+    Read the rows of a csv file one by one, without the headers
+
+    Arguments:
+    - file: csv file which contains all the data
+    - delimiter (str): csv delimiter
+
+    Returns:
+    - generator of stripped rows
+    """
+
+    with open(file) as csv_file:
+
+        # csv reader
+        csv_reader = csv.reader(csv_file, delimiter=delimiter)
+
+        # skip headers
+        next(csv_reader, None)
+
+        for row in csv_reader:
+            yield [item.strip() for item in row]
+
+
+def to_values(row):
+    """
+    Convert a csv row into the values stored in the google sheets
+
+    Arguments:
+    - row (list): date, item, debit and credit of a transaction
+
+    Returns:
+    - list with date, description, category, expenses and incomes
+    """
+
+    # Expense object
+    expense_obj = Expense(row[0], row[1], row[2], row[3])
+
+    return [expense_obj.date,
+            expense_obj.item,
+            expense_obj.category.value,
+            expense_obj.debit,
+            expense_obj.credit]
+
+
+def get_data(file, typed=False):
     """
     Extract the financial data from a csv file 
 
     Arguments:
     - file: csv file which contains all the data 
+    - typed (bool): dates as google sheets serial numbers and amounts as numbers (see encode_row)
 
     Returns:
     - data
     """
 
-    expenses = []
+    # get rows
+    with span("get_data.read", file=str(file)):
+        rows = list(read_rows(file))
 
-    # read csv file
-    with open(file) as file:
-        
-        # csv reader
-        csv_reader = csv.reader(file, delimiter=";")
+    # sort rows by date
+    with span("get_data.sort", rows=len(rows)):
+        rows.sort(key=parse_date)
 
-        # get headers and rows
-        old_headers = next(csv_reader)
-        new_headers = ["Date","Description","Category","Expenses", "Incomes"]
-        rows = [[item.strip() for item in row] for row in csv_reader]
-       
-        # sort rows by date
-        rows.sort(key=lambda row: datetime.strptime(row[0], "%d/%m/%Y"))
+    # add headers and rows in list
+    with span("get_data.categorize", rows=len(rows)):
+        expenses = [HEADERS]
+        expenses.extend(to_values(row) for row in rows)
 
-        # add headers in list
-        expenses.append(new_headers)
+    if typed:
+        with span("get_data.encode", rows=len(rows)):
+            expenses = encode_rows(expenses)
 
-        # add rows in list
-        for row in rows:
-            
-            # Expense object
-            expense_obj = Expense(row[0], row[1], row[2], row[3])
-            
-            # add data in list
-            try:
-                expenses.append([expense_obj.date,
-                            expense_obj.item,
-                            expense_obj.category.value,
-                            expense_obj.debit,
-                            expense_obj.credit])
-            except Exception as e:
-                raise e
-                
+    return expenses
+
+
+def encode_row(row, serials=None):
+    """
+    Convert the values of a row into typed values, uploaded without parsing by google sheets:
+    - the date becomes a google sheets serial number
+    - the amounts like "72,55" become numbers, empty amounts stay empty
+      and the amounts which are not numbers stay text
+
+    Arguments:
+    - row (list): date, description, category, expenses and incomes
+    - serials (dict): cache of the serial numbers of the dates, shared between rows
+
+    Returns:
+    - list of typed values
+    """
+
+    if serials is None:
+        serials = {}
+
+    serial = serials.get(row[0])
+    if serial is None:
+        serial = serials[row[0]] = datetime.strptime(row[0], DATE_FORMAT).toordinal() - SERIAL_EPOCH
+
+    return [serial, row[1], row[2], _encode_amount(row[3]), _encode_amount(row[4])]
+
+
+def _encode_amount(value):
+    try:
+        return typed_amount(parse_amount(value))
+    except (ValueError, ArithmeticError):
+        # uploaded as text, like utils.to_cell does
+        return value
+
+
+def typed_amount(cents):
+    """
+    Convert cents into the number of euros uploaded to google sheets, empty for no amount
+    """
+    return cents / 100 if cents else ""
+
+
+def typed_row(ordinal, item, category, debit, credit):
+    """
+    Typed values of a transaction, like encode_row
+
+    Arguments:
+    - ordinal (int): day ordinal of the date
+    - item (str): description
+    - category (str): value of the category
+    - debit (int): expense in cents
+    - credit (int): income in cents
+
+    Returns:
+    - list of typed values
+    """
+    return [ordinal - SERIAL_EPOCH, item, category, typed_amount(debit), typed_amount(credit)]
+
+
+def encode_rows(data):
+    """
+    Convert the rows of the data into typed values, see encode_row
+
+    Arguments:
+    - data (list): headers and rows
+
+    Returns:
+    - list with the headers and the typed rows
+    """
+
+    serials = {}
+
+    return [data[0]] + [encode_row(row, serials) for row in data[1:]]
+
+
+def is_date_ordered(file):
+    """
+    Check in a single streaming pass if the rows of a csv file are sorted by date
+
+    Arguments:
+    - file: csv file which contains all the data
+
+    Returns:
+    - True if the dates never decrease
+    """
+
+    previous = None
+
+    for row in read_rows(file):
+        current = parse_date(row)
+        if previous is not None and current < previous:
+            return False
+        previous = current
+
+    return True
+
+
+def _sorted_runs(file, run_size, tmp_dir):
+    """
+    Split a csv file into sorted runs spilled on disk
+
+    Arguments:
+    - file: csv file which contains all the data
+    - run_size (int): number of rows sorted in memory at once
+    - tmp_dir (str): directory where the runs are written
+
+    Returns:
+    - list of run file paths
+    """
+
+    runs = []
+    rows = read_rows(file)
+
+    while True:
+
+        # sort the next run in memory
+        run = list(islice(rows, run_size))
+        if not run:
+            break
+        run.sort(key=parse_date)
+
+        # spill the run on disk
+        path = os.path.join(tmp_dir, f"run_{len(runs)}.csv")
+        with open(path, "w", newline="") as run_file:
+            csv_writer = csv.writer(run_file, delimiter=";")
+            csv_writer.writerow(HEADERS)
+            csv_writer.writerows(run)
+        runs.append(path)
+
+    return runs
+
+
+def get_data_chunks(file, chunk_size=1000, run_size=100000, presorted=None, typed=False):
+    """
+    Extract the financial data from a csv file in chunks of rows, in constant memory.
+    Date-ordered files are streamed straight through, otherwise the rows are sorted
+    with an external merge sort over runs spilled on disk.
+
+    Arguments:
+    - file: csv file which contains all the data
+    - chunk_size (int): number of rows per chunk
+    - run_size (int): number of rows sorted in memory by the external sort
+    - presorted (bool): skip the order check if already known, None to check the file
+    - typed (bool): dates as google sheets serial numbers and amounts as numbers (see encode_row)
+
+    Returns:
+    - generator of lists of rows, without the headers (see HEADERS)
+    """
+
+    if presorted is None:
+        presorted = is_date_ordered(file)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        if presorted:
+            rows = read_rows(file)
+        else:
+            # merge the sorted runs, equal dates keep the file order
+            runs = _sorted_runs(file, run_size, tmp_dir)
+            rows = heapq.merge(*[read_rows(run) for run in runs], key=parse_date)
+
+        values = map(to_values, rows)
+        if typed:
+            values = map(encode_row, values, repeat({}))
+
+        while True:
+            chunk = list(islice(values, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def list_files(path):
+    """
+    List the csv files of a directory, a glob pattern or a single file
+
+    Arguments:
+    - path (str): directory, glob pattern like "exports/*.csv" or csv file
+
+    Returns:
+    - sorted list of files
+    """
+
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "*.csv")))
+
+    return sorted(glob.glob(path))
+
+
+def source_options(file, sources=None):
+    """
+    Get the csv format of a file
+
+    Arguments:
+    - file (str): csv file
+    - sources (dict): formats keyed by glob pattern of the file name, with the keys of DEFAULT_SOURCE
+
+    Returns:
+    - dict with the delimiter, the columns of the date, item, debit and credit, and the date format
+    """
+
+    options = dict(DEFAULT_SOURCE)
+
+    for pattern, source in (sources or {}).items():
+        if fnmatch(os.path.basename(file), pattern):
+            options.update(source)
+            break
+
+    return options
+
+
+def map_row(row, options=DEFAULT_SOURCE):
+    """
+    Select the date, item, debit and credit of a csv row of a bank export, the date is converted to DATE_FORMAT
+
+    Arguments:
+    - row (list): values of the csv row
+    - options (dict): csv format of the file, see source_options
+
+    Returns:
+    - list with the date, item, debit and credit
+    """
+
+    row = [row[column] if column < len(row) else "" for column in options["columns"]]
+    if options["date_format"] != DATE_FORMAT:
+        row[0] = datetime.strptime(row[0], options["date_format"]).strftime(DATE_FORMAT)
+
+    return row
+
+
+def load_file(file, options=DEFAULT_SOURCE):
+    """
+    Extract the sorted financial data of a csv file, used by the worker processes of get_data_multi
+
+    Arguments:
+    - file (str): csv file
+    - options (dict): csv format of the file, see source_options
+
+    Returns:
+    - rows sorted by date without the headers, and dict with the throughput of the file
+    """
+
+    start = time.perf_counter()
+    rows = [map_row(row, options) for row in read_rows(file, options["delimiter"])]
+
+    # sort rows by date
+    rows.sort(key=parse_date)
+    values = [to_values(row) for row in rows]
+
+    seconds = time.perf_counter() - start
+    stats = {"file": file, "rows": len(values), "seconds": seconds,
+             "rows_per_second": len(values) / seconds if seconds else 0}
+
+    return values, stats
+
+
+def get_data_multi(path, sources=None, workers=None, typed=False, dedup=None, cache=None, stats=None):
+    """
+    Extract the financial data of several csv files, parsed in parallel processes
+    and merged by date with a k-way merge
+
+    Arguments:
+    - path (str): directory, glob pattern or csv file
+    - sources (dict): csv formats keyed by glob pattern of the file name, see source_options
+    - workers (int): number of processes, None for the number of cpus
+    - typed (bool): dates as google sheets serial numbers and amounts as numbers (see encode_row)
+    - dedup (DedupIndex): drop the transactions already in the index, see DedupIndex.drop_seen
+    - cache (ParseCache): reuse the parsed files whose content didn't change when typed, see parse_cache.py
+    - stats (list): receives the throughput of each file, also written in the metrics
+
+    Returns:
+    - data with the headers and the rows of all the files
+    """
+
+    files = list_files(path)
+    options = [source_options(file, sources) for file in files]
+
+    # the cache stores typed rows, the text rows keep the amounts as written in the files
+    typed_rows = cache is not None and typed
+    load = cache.load_values if typed_rows else load_file
+
+    if len(files) == 1:
+        # a pool would only add its start up
+        results = [load(files[0], options[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load, files, options))
+
+    # overlapping exports repeat transactions
+    if dedup is not None:
+        with span("get_data_multi.dedup", files=len(files)):
+            results = [(dedup.drop_seen(values, source["source"]), stats)
+                       for (values, stats), source in zip(results, options)]
+
+    # throughput of each file
+    for _, file_stats in results:
+        metrics.emit({"type": "file", **file_stats})
+        if stats is not None:
+            stats.append(file_stats)
+
+    # the files are already sorted, equal dates keep the order of the files
+    with span("get_data_multi.merge", files=len(files)):
+        expenses = [HEADERS]
+        key = itemgetter(0) if typed_rows else parse_date
+        expenses.extend(heapq.merge(*[values for values, _ in results], key=key))
+
+    if typed and not typed_rows:
+        expenses = encode_rows(expenses)
 
     return expenses
 
+
+# categories are stored as small int codes in the ExpenseTable
+CATEGORIES = list(CATEGORY)
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+
+
+def parse_amount(value):
+    """
+    Convert an amount like "72,55", "1.234,56" or "1,234.56" into cents
+
+    Arguments:
+    - value (str): amount with a comma or dot decimal separator, empty for no amount
+
+    Returns:
+    - int number of cents
+    """
+
+    value = value.replace(" ", "").replace("\u00a0", "")
+
+    # the last separator is the decimal one, unless it is repeated like in "1.234.567",
+    # the others separate the thousands
+    position = max(value.rfind(","), value.rfind("."))
+    if position >= 0 and value.count(value[position]) == 1:
+        value = value[:position].replace(",", "").replace(".", "") + "." + value[position + 1:]
+    else:
+        value = value.replace(",", "").replace(".", "")
+
+    if not value:
+        return 0
+
+    return int((Decimal(value) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def format_amount(cents):
+    """
+    Convert cents into an amount like "72,55", the opposite of parse_amount
+
+    Arguments:
+    - cents (int): number of cents
+
+    Returns:
+    - str amount, empty for no amount
+    """
+
+    if not cents:
+        return ""
+
+    sign = "-" if cents < 0 else ""
+    units, cents = divmod(abs(cents), 100)
+
+    return f"{sign}{units},{cents:02d}".rstrip("0").rstrip(",")
+
+
+def day_ordinal(value):
+    """
+    Day ordinal of a date of get_data, typed (serial number) or dd/mm/yyyy
+    """
+
+    if isinstance(value, str):
+        return datetime.strptime(value, DATE_FORMAT).toordinal()
+
+    return value + SERIAL_EPOCH
+
+
+def month_index(value):
+    """
+    Month index (year * 12 + month - 1) of a date of get_data, typed (serial number) or dd/mm/yyyy
+    """
+
+    if isinstance(value, str):
+        # read without parsing the whole date
+        _, month, year = value.split("/")
+        return int(year) * 12 + int(month) - 1
+
+    day = date.fromordinal(value + SERIAL_EPOCH)
+    return day.year * 12 + day.month - 1
+
+
+def amount_cents(value):
+    """
+    Cents of an amount of get_data, typed (number of euros) or like "72,55", 0 for no amount
+    """
+
+    if isinstance(value, str):
+        return parse_amount(value)
+
+    return round(value * 100)
+
+
+class ExpenseRow():
+    """
+    Light view on a row of an ExpenseTable
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def date(self):
+        return date.fromordinal(self.table.dates[self.index])
+
+    @property
+    def item(self):
+        return self.table.items[self.index]
+
+    @property
+    def category(self):
+        return CATEGORIES[self.table.categories[self.index]]
+
+    @property
+    def debit(self):
+        return self.table.debits[self.index]
+
+    @property
+    def credit(self):
+        return self.table.credits[self.index]
+
+    def to_values(self, typed=False):
+        if typed:
+            return typed_row(self.table.dates[self.index], self.item, self.category.value, self.debit, self.credit)
+
+        return [self.date.strftime(DATE_FORMAT),
+                self.item,
+                self.category.value,
+                format_amount(self.debit),
+                format_amount(self.credit)]
+
+
+class ExpenseTable():
+    """
+    Column-oriented storage of the expenses:
+    - dates: day ordinals
+    - items: descriptions, interned so repeated merchants are stored once
+    - categories: codes into CATEGORIES
+    - debits, credits: amounts in cents
+    """
+
+    def __init__(self):
+        self.dates = array("i")
+        self.items = []
+        self.categories = array("b")
+        self.debits = array("q")
+        self.credits = array("q")
+
+        # parsed dates, the same days come back in every export
+        self._ordinals = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Create a table from csv rows
+
+        Arguments:
+        - rows: iterable of date, item, debit and credit rows
+
+        Returns:
+        - ExpenseTable
+        """
+
+        table = cls()
+        for row in rows:
+            table.append(row[0], row[1], row[2], row[3])
+
+        return table
+
+    @classmethod
+    def from_values(cls, data):
+        """
+        Create a table from the data of get_data, the categories are determined again
+
+        Arguments:
+        - data (list): headers and rows of get_data, typed or not
+
+        Returns:
+        - ExpenseTable
+        """
+        return cls.from_rows((row[0], row[1], row[3], row[4]) for row in data[1:])
+
+    @classmethod
+    def from_file(cls, file, delimiter=";"):
+        """
+        Create a table sorted by date from a csv file
+
+        Arguments:
+        - file: csv file which contains all the data
+        - delimiter (str): csv delimiter
+
+        Returns:
+        - ExpenseTable
+        """
+        return cls.from_rows(read_rows(file, delimiter)).sort()
+
+    def append(self, date_value, item, debit, credit):
+        """
+        Add a transaction at the end of the table
+
+        Arguments:
+        - date_value (str or int): dd/mm/yyyy date or google sheets serial number
+        - item (str): description
+        - debit (str or float): expense amount, like "72,55" or typed
+        - credit (str or float): income amount, like "72,55" or typed
+        """
+
+        ordinal = self._ordinals.get(date_value)
+        if ordinal is None:
+            ordinal = self._ordinals[date_value] = day_ordinal(date_value)
+
+        self.dates.append(ordinal)
+        self.items.append(sys.intern(item))
+        self.categories.append(CATEGORY_CODES[get_rules().categorize(item)])
+        self.debits.append(amount_cents(debit))
+        self.credits.append(amount_cents(credit))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ExpenseTable index out of range")
+
+        return ExpenseRow(self, index)
+
+    def __iter__(self):
+        return (ExpenseRow(self, index) for index in range(len(self)))
+
+    def take(self, indexes):
+        """
+        Create a new table with the rows at the given indexes
+
+        Arguments:
+        - indexes: iterable of row indexes
+
+        Returns:
+        - ExpenseTable
+        """
+
+        indexes = list(indexes)
+        table = ExpenseTable()
+        table.dates = array("i", map(self.dates.__getitem__, indexes))
+        table.items = list(map(self.items.__getitem__, indexes))
+        table.categories = array("b", map(self.categories.__getitem__, indexes))
+        table.debits = array("q", map(self.debits.__getitem__, indexes))
+        table.credits = array("q", map(self.credits.__getitem__, indexes))
+        table._ordinals = self._ordinals
+
+        return table
+
+    def sort(self):
+        """
+        Sort the rows by date, rows of the same day keep their order
+
+        Returns:
+        - new sorted ExpenseTable
+        """
+        return self.take(sorted(range(len(self)), key=self.dates.__getitem__))
+
+    def filter(self, category=None, start=None, end=None):
+        """
+        Select the rows of a category and/or a period
+
+        Arguments:
+        - category (CATEGORY): category of the rows, None for all
+        - start (date): first day included, None for no limit
+        - end (date): last day included, None for no limit
+
+        Returns:
+        - new ExpenseTable
+        """
+
+        masks = []
+        if category is not None:
+            code = CATEGORY_CODES[category]
+            masks.append(map(code.__eq__, self.categories))
+        if start is not None:
+            masks.append(map(start.toordinal().__le__, self.dates))
+        if end is not None:
+            masks.append(map(end.toordinal().__ge__, self.dates))
+
+        mask = map(all, zip(*masks)) if masks else repeat(True)
+
+        return self.take(compress(range(len(self)), mask))
+
+    def total_by_category(self, column="debits"):
+        """
+        Sum an amount column by category
+
+        Arguments:
+        - column (str): "debits" or "credits"
+
+        Returns:
+        - dict with the total in cents of each CATEGORY
+        """
+
+        totals = [0] * len(CATEGORIES)
+        for code, amount in zip(self.categories, getattr(self, column)):
+            totals[code] += amount
+
+        return {CATEGORIES[code]: total for code, total in enumerate(totals) if total}
+
+    def to_values(self, typed=False):
+        """
+        Convert the table into the values stored in the google sheets, like get_data
+
+        Arguments:
+        - typed (bool): dates as google sheets serial numbers and amounts as numbers (see encode_row)
+
+        Returns:
+        - list with the headers and the rows
+        """
+
+        values = [HEADERS]
+        labels = [category.value for category in CATEGORIES]
+        columns = zip(self.dates, self.items, self.categories, self.debits, self.credits)
+
+        if typed:
+            values.extend(typed_row(ordinal, item, labels[code], debit, credit)
+                          for ordinal, item, code, debit, credit in columns)
+            return values
+
+        # the same days come back for every transaction of the day
+        days = {}
+        for ordinal, item, code, debit, credit in columns:
+            day = days.get(ordinal)
+            if day is None:
+                day = days[ordinal] = date.fromordinal(ordinal).strftime(DATE_FORMAT)
+            values.append([day, item, labels[code], format_amount(debit), format_amount(credit)])
+
+        return values
@@ -0,0 +1,235 @@
+from data_loader import amount_cents, day_ordinal
+
+import hashlib
+import mmap
+import os
+import struct
+
+
+# persistent index of the imported transactions
+DEDUP_FILE = "dedup.idx"
+
+# file layout: header (magic, number of fingerprints) then the slots of an open addressing hash table,
+# one little endian uint64 fingerprint per slot, 0 for an empty slot
+MAGIC = b"EXPDEDUP"
+HEADER = struct.Struct("<8sQ")
+MIN_CAPACITY = 1024
+MAX_LOAD = 0.5
+
+# bloom filter
+BITS_PER_KEY = 10
+HASHES = 7
+
+
+def fingerprint(row, source="", occurrence=0):
+    """
+    Fingerprint of a transaction, from its normalized date, description, amount and source
+
+    Arguments:
+    - row (list): date, description, category, expenses and incomes, like the rows of get_data, typed or not
+    - source (str): account of the transaction
+    - occurrence (int): number of identical transactions before this one in the same export,
+      so genuine repeated transactions of a day are kept
+
+    Returns:
+    - int non zero 64 bits fingerprint
+    """
+
+    day = day_ordinal(row[0])
+    description = " ".join(row[1].lower().split())
+    amount = amount_cents(row[3]) - amount_cents(row[4])
+
+    key = f"{day}\x1f{description}\x1f{amount}\x1f{source}\x1f{occurrence}".encode()
+
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+def fingerprints(rows, source="", occurrences=None):
+    """
+    Fingerprints of the transactions of an export, identical transactions get their occurrence number
+
+    Arguments:
+    - rows (list): rows of an export without the headers, like get_data
+    - source (str): account of the export
+    - occurrences (dict): occurrence numbers of the rows of the export already fingerprinted,
+      updated in place, None when rows is the whole export
+
+    Returns:
+    - generator of fingerprints
+    """
+
+    if occurrences is None:
+        occurrences = {}
+
+    for row in rows:
+        base = fingerprint(row, source)
+        occurrence = occurrences[base] = occurrences.get(base, -1) + 1
+
+        yield base if occurrence == 0 else fingerprint(row, source, occurrence)
+
+
+class BloomFilter():
+    """
+    In-memory bloom filter of fingerprints, a fast "definitely new" check before the hash table
+    """
+
+    def __init__(self, keys):
+        self.size = max(keys * BITS_PER_KEY, 8 * 1024)
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def _positions(self, key):
+        # double hashing from the two halves of the fingerprint
+        first, second = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [(first + i * second) % self.size for i in range(HASHES)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class DedupIndex():
+    """
+    Set of transaction fingerprints stored as a memory-mapped hash table on disk,
+    checked first with an in-memory bloom filter
+
+    Arguments:
+    - path (str): file of the index, None for an index in memory only
+    """
+
+    def __init__(self, path=DEDUP_FILE):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+        if path is not None and os.path.exists(path):
+            self.file = open(path, "r+b")
+            magic, self.count = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a dedup index")
+            self._map(os.path.getsize(path))
+        else:
+            self._create(MIN_CAPACITY)
+            self._replace()
+
+    def _create(self, capacity):
+        size = HEADER.size + capacity * 8
+
+        if self.path is None:
+            self.file = None
+            self.mmap = mmap.mmap(-1, size)
+        else:
+            self.file = open(self.path + ".tmp", "w+b")
+            self.file.truncate(size)
+            self.mmap = mmap.mmap(self.file.fileno(), size)
+
+        self.slots = memoryview(self.mmap)[HEADER.size:].cast("Q")
+        self.capacity = capacity
+        self.bloom = BloomFilter(int(capacity * MAX_LOAD))
+        self._write_header()
+
+    def _replace(self):
+        # the new table replaces the old one once complete
+        if self.path is not None:
+            self.mmap.flush()
+            os.replace(self.path + ".tmp", self.path)
+
+    def _map(self, size):
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        self.slots = memoryview(self.mmap)[HEADER.size:].cast("Q")
+        self.capacity = len(self.slots)
+
+        # the bloom filter is rebuilt from the slots
+        self.bloom = BloomFilter(int(self.capacity * MAX_LOAD))
+        for key in self.slots:
+            if key:
+                self.bloom.add(key)
+
+    def _write_header(self):
+        HEADER.pack_into(self.mmap, 0, MAGIC, self.count)
+
+    def _slot(self, key):
+        # linear probing, the capacity is a power of 2
+        mask = self.capacity - 1
+        slot = key & mask
+        while self.slots[slot] and self.slots[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        if key not in self.bloom:
+            return False
+        return self.slots[self._slot(key)] == key
+
+    def add(self, key):
+        """
+        Add a fingerprint to the index
+
+        Arguments:
+        - key (int): fingerprint of a transaction
+
+        Returns:
+        - True if the fingerprint was not in the index
+        """
+
+        if key in self:
+            return False
+
+        if self.count + 1 > self.capacity * MAX_LOAD:
+            self._grow()
+
+        self.slots[self._slot(key)] = key
+        self.bloom.add(key)
+        self.count += 1
+        self._write_header()
+
+        return True
+
+    def drop_seen(self, rows, source=""):
+        """
+        Drop the transactions of an export which are already in the index, and add the new ones
+
+        Arguments:
+        - rows (list): rows of an export without the headers, like get_data
+        - source (str): account of the export
+
+        Returns:
+        - list of the new rows
+        """
+
+        return [row for row, key in zip(rows, fingerprints(rows, source)) if self.add(key)]
+
+    def _grow(self):
+        keys = [key for key in self.slots if key]
+        self._close_map()
+        self._create(self.capacity * 2)
+
+        for key in keys:
+            self.slots[self._slot(key)] = key
+            self.bloom.add(key)
+
+        self._replace()
+
+    def _close_map(self):
+        self.slots.release()
+        self.mmap.close()
+        if self.file is not None:
+            self.file.close()
+
+    def close(self):
+        """
+        Write the index on disk and close it
+        """
+        self.mmap.flush()
+        self._close_map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
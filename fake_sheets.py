@@ -0,0 +1,534 @@
+from googleapiclient.errors import HttpError
+import httplib2
+
+import json
+import random
+import re
+import threading
+import time
+
+# pivot table fields the api leaves out of the responses when they hold their default value
+PIVOT_DEFAULTS = {
+    "showTotals": False,
+    "sheetId": 0,
+    "startRowIndex": 0,
+    "startColumnIndex": 0,
+    "sourceColumnOffset": 0,
+    "valueLayout": "HORIZONTAL",
+}
+
+
+class FakeRequest():
+    """
+    Request of the fake service, executed like a googleapiclient request
+    """
+
+    def __init__(self, service, method, kwargs, handler):
+        self.service = service
+        self.method = method
+        self.kwargs = kwargs
+        self.handler = handler
+
+        # like googleapiclient requests, for the metrics
+        self.methodId = f"sheets.spreadsheets.{method}"
+        self.body = json.dumps(kwargs["body"]) if "body" in kwargs else None
+        self.uri = f"https://sheets.googleapis.com/v4/spreadsheets/{kwargs.get('spreadsheetId', '')}"
+
+    def execute(self, http=None, num_retries=0):
+        return self.service.execute(self)
+
+
+class FakeSheetsService():
+    """
+    In-memory stand-in of the google sheets service, for the subset of the API used by utils:
+    - spreadsheets().create/get/batchUpdate
+    - spreadsheets().values().update/append/batchGet/batchUpdate/clear
+
+    Arguments:
+    - latency (float): seconds waited by each request
+    - max_payload (int): maximum size in bytes of a request body, bigger requests fail with a 413
+    - error_rate (float): probability of a request to fail with a 429
+    - seed (int): seed of the error injection
+    """
+
+    def __init__(self, latency=0.0, max_payload=10_000_000, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.max_payload = max_payload
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.spreadsheets_data = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the request count, the bytes sent and received and the number of injected errors
+        """
+        self.stats = {"requests": 0, "bytes_sent": 0, "bytes_received": 0, "errors": 0}
+
+    # ----- request execution ---------
+
+    def execute(self, request):
+        """
+        Execute a request of the fake service, with latency and error injection
+
+        Arguments:
+        - request (FakeRequest): request to execute
+
+        Returns:
+        - response of the request
+        """
+
+        size = len(json.dumps(request.kwargs))
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_sent"] += size
+            inject_error = self.random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if inject_error:
+            with self.lock:
+                self.stats["errors"] += 1
+            raise _http_error(429, "Quota exceeded")
+
+        if size > self.max_payload:
+            raise _http_error(413, "Request payload size exceeds the limit")
+
+        with self.lock:
+            response = request.handler(**request.kwargs)
+            self.stats["bytes_received"] += len(json.dumps(response))
+
+        return response
+
+    def _request(self, method, kwargs, handler):
+        return FakeRequest(self, method, kwargs, handler)
+
+    # ----- resources ---------
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def sheet(self, spreadsheet_id, sheet):
+        """
+        Get the state of a sheet
+
+        Arguments:
+        - spreadsheet_id (str): id of the spreadsheet
+        - sheet: id or title of the sheet
+
+        Returns:
+        - dict with the properties, values (list of rows), pivots and formats of the sheet
+        """
+
+        try:
+            sheets = self.spreadsheets_data[spreadsheet_id]["sheets"]
+        except KeyError:
+            raise _http_error(404, f"Requested entity was not found: {spreadsheet_id}")
+
+        for state in sheets:
+            if sheet in (state["properties"]["sheetId"], state["properties"]["title"]):
+                return state
+
+        raise _http_error(400, f"Unable to parse range: {sheet}")
+
+
+class _Spreadsheets():
+
+    def __init__(self, service):
+        self.service = service
+
+    def values(self):
+        return _Values(self.service)
+
+    def create(self, body):
+        return self.service._request("create", {"body": body}, self._create)
+
+    def get(self, spreadsheetId, ranges=None, fields=None, includeGridData=False):
+        kwargs = {"spreadsheetId": spreadsheetId, "ranges": ranges, "fields": fields,
+                  "includeGridData": includeGridData}
+        return self.service._request("get", kwargs, self._get)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return self.service._request("batchUpdate", {"spreadsheetId": spreadsheetId, "body": body},
+                                     self._batch_update)
+
+    def _create(self, body):
+        spreadsheet_id = f"fake{len(self.service.spreadsheets_data)}"
+
+        sheets = [_new_sheet(sheet["properties"]) for sheet in body.get("sheets", [])] or \
+            [_new_sheet({"sheetId": 0, "title": "Sheet1"})]
+
+        self.service.spreadsheets_data[spreadsheet_id] = {
+            "properties": dict(body.get("properties", {})),
+            "sheets": sheets
+        }
+
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "spreadsheetUrl": f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit",
+            "properties": dict(body.get("properties", {})),
+            "sheets": [{"properties": sheet["properties"]} for sheet in sheets]
+        }
+
+    def _get(self, spreadsheetId, ranges=None, fields=None, includeGridData=False):
+        # the fields mask is not applied, the response always has the same shape
+        spreadsheet = self.service.spreadsheets_data.get(spreadsheetId)
+        if spreadsheet is None:
+            raise _http_error(404, f"Requested entity was not found: {spreadsheetId}")
+
+        titles = {_parse_range(sheet_range)[0] for sheet_range in ranges or []}
+
+        sheets = []
+        for sheet in spreadsheet["sheets"]:
+            response = {"properties": sheet["properties"]}
+            if includeGridData or sheet["properties"]["title"] in titles:
+                response["data"] = [_grid_data(sheet)]
+            sheets.append(response)
+
+        return {"spreadsheetId": spreadsheetId, "properties": spreadsheet["properties"], "sheets": sheets}
+
+    def _batch_update(self, spreadsheetId, body):
+        replies = []
+
+        for request in body["requests"]:
+            (kind, params), = request.items()
+            handler = getattr(self, f"_{kind}", None)
+            if handler is None:
+                raise _http_error(400, f"Unsupported request: {kind}")
+            replies.append(handler(spreadsheetId, params) or {})
+
+        return {"spreadsheetId": spreadsheetId, "replies": replies}
+
+    # ----- batchUpdate requests ---------
+
+    def _updateCells(self, spreadsheet_id, params):
+        if "range" in params:
+            grid_range = params["range"]
+            sheet = self.service.sheet(spreadsheet_id, grid_range["sheetId"])
+            start_row, start_column = grid_range.get("startRowIndex", 0), grid_range.get("startColumnIndex", 0)
+        else:
+            start = params["start"]
+            sheet = self.service.sheet(spreadsheet_id, start["sheetId"])
+            start_row, start_column = start.get("rowIndex", 0), start.get("columnIndex", 0)
+
+        rows = params.get("rows")
+
+        # without rows, the fields of the range are cleared
+        if rows is None:
+            grid_range = params["range"]
+            _clear(sheet, start_row, grid_range.get("endRowIndex"), start_column, grid_range.get("endColumnIndex"),
+                   pivots=params["fields"] in ("*", "pivotTable"))
+            return
+
+        if isinstance(rows, dict):
+            rows = [rows]
+
+        for row_offset, row in enumerate(rows):
+            for column_offset, cell in enumerate(row.get("values", [])):
+                position = (start_row + row_offset, start_column + column_offset)
+                if "pivotTable" in cell:
+                    sheet["pivots"][position] = cell["pivotTable"]
+                if "userEnteredValue" in cell or params["fields"] in ("*", "userEnteredValue"):
+                    _set_value(sheet, *position, _cell_value(cell))
+
+    def _appendCells(self, spreadsheet_id, params):
+        sheet = self.service.sheet(spreadsheet_id, params["sheetId"])
+        start_row = _last_row(sheet)
+
+        for row_offset, row in enumerate(params["rows"]):
+            for column, cell in enumerate(row.get("values", [])):
+                _set_value(sheet, start_row + row_offset, column, _cell_value(cell))
+
+    def _repeatCell(self, spreadsheet_id, params):
+        sheet = self.service.sheet(spreadsheet_id, params["range"]["sheetId"])
+        sheet["formats"].append(params)
+
+    def _addSheet(self, spreadsheet_id, params):
+        sheets = self.service.spreadsheets_data[spreadsheet_id]["sheets"]
+        properties = dict(params.get("properties", {}))
+        properties.setdefault("sheetId", max(sheet["properties"]["sheetId"] for sheet in sheets) + 1)
+        properties.setdefault("title", f"Sheet{len(sheets) + 1}")
+
+        for sheet in sheets:
+            if properties["title"] == sheet["properties"]["title"]:
+                raise _http_error(400, f"A sheet with the name \"{properties['title']}\" already exists")
+
+        sheets.append(_new_sheet(properties))
+
+        return {"addSheet": {"properties": properties}}
+
+    def _updateSheetProperties(self, spreadsheet_id, params):
+        properties = params["properties"]
+        sheet = self.service.sheet(spreadsheet_id, properties["sheetId"])
+        sheet["properties"].update(properties)
+
+    def _addChart(self, spreadsheet_id, params):
+        chart = dict(params["chart"])
+        anchor = chart["position"]["overlayPosition"]["anchorCell"]
+        sheet = self.service.sheet(spreadsheet_id, anchor["sheetId"])
+
+        charts = [chart_id for sheet in self.service.spreadsheets_data[spreadsheet_id]["sheets"]
+                  for chart_id in sheet["charts"]]
+        if chart.get("chartId") in charts:
+            raise _http_error(400, f"A chart with the id {chart['chartId']} already exists")
+        chart.setdefault("chartId", max(charts, default=0) + 1)
+
+        sheet["charts"][chart["chartId"]] = chart
+
+        return {"addChart": {"chart": chart}}
+
+    def _updateChartSpec(self, spreadsheet_id, params):
+        for sheet in self.service.spreadsheets_data[spreadsheet_id]["sheets"]:
+            if params["chartId"] in sheet["charts"]:
+                sheet["charts"][params["chartId"]]["spec"] = params["spec"]
+                return
+
+        raise _http_error(400, f"No chart with id: {params['chartId']}")
+
+
+class _Values():
+
+    def __init__(self, service):
+        self.service = service
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        kwargs = {"spreadsheetId": spreadsheetId, "range": range, "valueInputOption": valueInputOption, "body": body}
+        return self.service._request("values.update", kwargs, self._update)
+
+    def append(self, spreadsheetId, range, valueInputOption, body, insertDataOption="OVERWRITE"):
+        kwargs = {"spreadsheetId": spreadsheetId, "range": range, "valueInputOption": valueInputOption,
+                  "insertDataOption": insertDataOption, "body": body}
+        return self.service._request("values.append", kwargs, self._append)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return self.service._request("values.batchUpdate", {"spreadsheetId": spreadsheetId, "body": body},
+                                     self._batch_update)
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension="ROWS", valueRenderOption="FORMATTED_VALUE"):
+        kwargs = {"spreadsheetId": spreadsheetId, "ranges": ranges}
+        return self.service._request("values.batchGet", kwargs, self._batch_get)
+
+    def clear(self, spreadsheetId, range, body=None):
+        return self.service._request("values.clear", {"spreadsheetId": spreadsheetId, "range": range},
+                                     self._clear)
+
+    def _write(self, spreadsheet_id, value_range, values, start_row=None):
+        title, range_start_row, start_column, _, _ = _parse_range(value_range)
+        sheet = self.service.sheet(spreadsheet_id, title)
+        if start_row is None:
+            start_row = range_start_row
+
+        for row_offset, row in enumerate(values):
+            for column_offset, value in enumerate(row):
+                _set_value(sheet, start_row + row_offset, start_column + column_offset, value)
+
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "updatedRange": value_range,
+            "updatedRows": len(values),
+            "updatedCells": sum(len(row) for row in values)
+        }
+
+    def _update(self, spreadsheetId, range, valueInputOption, body):
+        return self._write(spreadsheetId, range, body["values"])
+
+    def _append(self, spreadsheetId, range, valueInputOption, body, insertDataOption):
+        title, start_row, _, _, _ = _parse_range(range)
+        sheet = self.service.sheet(spreadsheetId, title)
+        start_row = max(start_row, _last_row(sheet))
+
+        updates = self._write(spreadsheetId, range, body["values"], start_row)
+
+        # like the api, the range of the cells actually written
+        width = max((len(row) for row in body["values"]), default=1)
+        updates["updatedRange"] = (f"{title}!A{start_row + 1}:{_column_letters(width - 1)}"
+                                   f"{start_row + len(body['values'])}")
+
+        return {"spreadsheetId": spreadsheetId, "updates": updates}
+
+    def _batch_update(self, spreadsheetId, body):
+        responses = [self._write(spreadsheetId, value_range["range"], value_range["values"])
+                     for value_range in body["data"]]
+
+        return {
+            "spreadsheetId": spreadsheetId,
+            "totalUpdatedRows": sum(response["updatedRows"] for response in responses),
+            "responses": responses
+        }
+
+    def _batch_get(self, spreadsheetId, ranges):
+        value_ranges = []
+
+        for value_range in ranges:
+            title, start_row, start_column, end_row, end_column = _parse_range(value_range)
+            sheet = self.service.sheet(spreadsheetId, title)
+            rows = sheet["values"][start_row:end_row]
+            values = [row[start_column:end_column] for row in rows]
+
+            # trailing empty cells and rows are not returned
+            values = [_trim(row) for row in values]
+            while values and not values[-1]:
+                values.pop()
+
+            value_ranges.append({"range": value_range, "majorDimension": "ROWS", "values": values})
+
+        return {"spreadsheetId": spreadsheetId, "valueRanges": value_ranges}
+
+    def _clear(self, spreadsheetId, range):
+        title, start_row, start_column, end_row, end_column = _parse_range(range)
+        sheet = self.service.sheet(spreadsheetId, title)
+        _clear(sheet, start_row, end_row, start_column, end_column)
+
+        return {"spreadsheetId": spreadsheetId, "clearedRange": range}
+
+
+# ----- sheet state ---------
+
+def _http_error(status, message):
+    resp = httplib2.Response({"status": status})
+    resp.reason = message
+    content = json.dumps({"error": {"code": status, "message": message}}).encode()
+    return HttpError(resp, content)
+
+
+def _new_sheet(properties):
+    properties = dict(properties)
+    properties.setdefault("gridProperties", {"rowCount": 1000, "columnCount": 26})
+
+    return {"properties": properties, "values": [], "pivots": {}, "formats": [], "charts": {}}
+
+
+def _cell_value(cell):
+    value = cell.get("userEnteredValue", {})
+    for key in ("numberValue", "stringValue", "boolValue", "formulaValue"):
+        if key in value:
+            return value[key]
+    return ""
+
+
+def _set_value(sheet, row, column, value):
+    rows = sheet["values"]
+    while len(rows) <= row:
+        rows.append([])
+    while len(rows[row]) <= column:
+        rows[row].append("")
+    rows[row][column] = value
+
+    grid = sheet["properties"]["gridProperties"]
+    grid["rowCount"] = max(grid["rowCount"], row + 1)
+    grid["columnCount"] = max(grid["columnCount"], column + 1)
+
+
+def _clear(sheet, start_row, end_row, start_column, end_column, pivots=False):
+    for row in sheet["values"][start_row:end_row]:
+        stop = len(row) if end_column is None else min(end_column, len(row))
+        for column in range(start_column, stop):
+            row[column] = ""
+
+    if pivots:
+        for row, column in list(sheet["pivots"]):
+            if start_row <= row < (end_row or float("inf")) and start_column <= column < (end_column or float("inf")):
+                del sheet["pivots"][row, column]
+
+
+def _trim(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _last_row(sheet):
+    rows = sheet["values"]
+    last = len(rows)
+    while last and not any(value != "" for value in rows[last - 1]):
+        last -= 1
+    return last
+
+
+def _grid_data(sheet):
+    row_count = max([len(sheet["values"])] + [row + 1 for row, _ in sheet["pivots"]])
+    row_data = []
+
+    for row in range(row_count):
+        values = sheet["values"][row] if row < len(sheet["values"]) else []
+        columns = max([len(values)] + [column + 1 for pivot_row, column in sheet["pivots"] if pivot_row == row])
+        cells = []
+        for column in range(columns):
+            cell = {}
+            value = values[column] if column < len(values) else ""
+            if isinstance(value, (int, float)):
+                cell["userEnteredValue"] = {"numberValue": value}
+            elif value != "":
+                cell["userEnteredValue"] = {"stringValue": value}
+            if (row, column) in sheet["pivots"]:
+                cell["pivotTable"] = _omit_defaults(sheet["pivots"][row, column])
+            cells.append(cell)
+        row_data.append({"values": cells})
+
+    return {"startRow": 0, "startColumn": 0, "rowData": row_data}
+
+
+def _omit_defaults(value):
+    # like the api, the responses leave out the pivot fields still at their default value
+    if isinstance(value, dict):
+        return {
+            key: _omit_defaults(item) for key, item in value.items()
+            if key not in PIVOT_DEFAULTS or item != PIVOT_DEFAULTS[key]
+        }
+
+    if isinstance(value, list):
+        return [_omit_defaults(item) for item in value]
+
+    return value
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter.upper()) - ord("A") + 1
+    return index - 1
+
+
+def _column_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def _parse_range(value_range):
+    """
+    Parse an A1 range like "data!A5:E10", "data!A5" or "data"
+
+    Returns:
+    - sheet title, start row, start column, end row, end column (end indexes are exclusive, None if open)
+    """
+
+    title, _, cells = value_range.partition("!")
+    title = title.strip("'")
+    if not cells:
+        return title, 0, 0, None, None
+
+    match = re.fullmatch(r"([A-Za-z]*)(\d*)(?::([A-Za-z]*)(\d*))?", cells)
+    if match is None:
+        raise _http_error(400, f"Unable to parse range: {value_range}")
+    start_letters, start_digits, end_letters, end_digits = match.groups()
+
+    start_row = int(start_digits) - 1 if start_digits else 0
+    start_column = _column_index(start_letters) if start_letters else 0
+    end_row = int(end_digits) if end_digits else None
+    end_column = _column_index(end_letters) + 1 if end_letters else None
+
+    # a single cell
+    if match.group(3) is None and match.group(4) is None:
+        end_row = start_row + 1 if start_digits else None
+        end_column = start_column + 1 if start_letters else None
+
+    return title, start_row, start_column, end_row, end_column
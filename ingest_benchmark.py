@@ -0,0 +1,215 @@
+from data_loader import Expense, read_rows, parse_date
+from categories import get_rules
+from synthetic import generate_ledger
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak memory is not measured
+    resource = None
+
+
+# phases of get_data, timed separately
+PHASES = ["read", "sort", "construct", "categorize"]
+
+# results of a reference run, keyed by number of rows then phase
+BASELINE_FILE = "ingest_baseline.json"
+
+# a phase regresses when it is this much slower, or uses this much more memory, than the baseline
+THRESHOLD = 0.2
+
+
+def _peak_rss():
+    """
+    Peak resident memory of the process in MB, None if it can't be measured
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _phase(name, file):
+    """
+    Run a phase in a fresh process, after the phases it depends on
+
+    Returns:
+    - dict with the number of rows, the seconds and the peak memory of the phase
+    """
+
+    rules = get_rules()
+    rows = items = None
+
+    # inputs of the phase, not timed
+    if name != "read":
+        rows = list(read_rows(file))
+    if name in ("construct", "categorize"):
+        rows.sort(key=parse_date)
+        items = [row[1] for row in rows]
+    if name == "construct":
+        # the categories are already cached, the phase measures the objects only
+        for item in set(items):
+            rules.categorize(item)
+
+    before = _peak_rss()
+    start = time.perf_counter()
+
+    # the output of the phase stays referenced until its peak memory is read
+    if name == "read":
+        output = rows = list(read_rows(file))
+    elif name == "sort":
+        rows.sort(key=parse_date)
+        output = rows
+    elif name == "construct":
+        output = [Expense(row[0], row[1], row[2], row[3]) for row in rows]
+    elif name == "categorize":
+        output = [rules.categorize(item) for item in items]
+
+    seconds = time.perf_counter() - start
+    peak = _peak_rss()
+
+    return {
+        "phase": name,
+        "rows": len(output),
+        "seconds": seconds,
+        "rows_per_second": len(output) / seconds if seconds else 0,
+        "peak_rss_mb": peak,
+        "rss_growth_mb": peak - before if peak is not None else None,
+    }
+
+
+def run(rows, merchant_count=100, disorder=0.0, directory=None):
+    """
+    Generate a synthetic ledger and time each phase of get_data on it, each phase in its own process
+    so its peak memory is not hidden by the previous ones
+
+    Arguments:
+    - rows (int): number of transactions
+    - merchant_count (int): number of distinct descriptions
+    - disorder (float): share of the transactions out of order
+    - directory (str): directory of the generated ledger, None for a temporary one
+
+    Returns:
+    - list with the rows per second and the peak memory of each phase
+    """
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        file = os.path.join(tmp_dir, f"ledger_{rows}.csv")
+        generate_ledger(file, rows, merchant_count, disorder=disorder)
+
+        results = []
+        for name in PHASES:
+            # spawn, a forked child would inherit the peak memory of the parent
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                results.append(executor.submit(_phase, name, file).result())
+
+    return results
+
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    """
+    Load the baseline results
+
+    Returns:
+    - dict keyed by number of rows (str) then phase, empty if there is no baseline
+    """
+
+    if not os.path.exists(baseline_file):
+        return {}
+
+    with open(baseline_file) as file:
+        return json.load(file)
+
+
+def save_baseline(results, baseline_file=BASELINE_FILE):
+    """
+    Save results as the baseline of their number of rows, the other sizes are kept
+    """
+
+    baseline = load_baseline(baseline_file)
+    for result in results:
+        baseline.setdefault(str(result["rows"]), {})[result["phase"]] = result
+
+    with open(baseline_file, "w") as file:
+        json.dump(baseline, file, indent=2)
+
+
+def regressions(results, baseline, threshold=THRESHOLD):
+    """
+    Compare results with the baseline
+
+    Arguments:
+    - results (list): results of run
+    - baseline (dict): see load_baseline
+    - threshold (float): tolerated relative slowdown or memory growth
+
+    Returns:
+    - list of messages, one per regressed metric
+    """
+
+    messages = []
+
+    for result in results:
+        reference = baseline.get(str(result["rows"]), {}).get(result["phase"])
+        if reference is None:
+            continue
+
+        label = f"{result['rows']} rows {result['phase']}"
+        if result["rows_per_second"] < reference["rows_per_second"] * (1 - threshold):
+            messages.append(f"{label}: {result['rows_per_second']:.0f} rows/s, "
+                            f"baseline {reference['rows_per_second']:.0f} rows/s")
+
+        if result["peak_rss_mb"] is not None and reference.get("peak_rss_mb") is not None and \
+                result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + threshold):
+            messages.append(f"{label}: {result['peak_rss_mb']:.1f} MB peak, "
+                            f"baseline {reference['peak_rss_mb']:.1f} MB")
+
+    return messages
+
+
+if __name__ == "__main__":
+
+    # command line arguments
+    parser = argparse.ArgumentParser(description="Benchmark the phases of get_data on synthetic ledgers")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000], help="sizes of the ledgers")
+    parser.add_argument("--merchants", type=int, default=100, help="number of distinct descriptions")
+    parser.add_argument("--disorder", type=float, default=0.0, help="share of the transactions out of order")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="json file of the baseline results")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="tolerated slowdown or memory growth, exit 1 beyond it")
+    parser.add_argument("--json", action="store_true", help="print the results as json lines")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        for result in run(rows, args.merchants, args.disorder):
+            results.append(result)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                peak = f"{result['peak_rss_mb']:8.1f} MB peak" if result["peak_rss_mb"] is not None else ""
+                print(f"{result['rows']:>9} rows  {result['phase']:<12} {result['rows_per_second']:>12.0f} rows/s "
+                      f"{peak}")
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+    else:
+        messages = regressions(results, load_baseline(args.baseline), args.threshold)
+        for message in messages:
+            print(f"regression: {message}")
+        if messages:
+            sys.exit(1)
@@ -0,0 +1,223 @@
+from data_loader import DATE_FORMAT, HEADERS, amount_cents, day_ordinal, format_amount, month_index, typed_row
+from aggregate import month_label
+from dedup import fingerprints
+from utils import execute_with_retry, create_pivot_tables, format_cells, forget_manifest
+
+from datetime import date
+import sqlite3
+
+
+# local database of the transactions
+LEDGER_FILE = "ledger.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    day INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL,
+    debit INTEGER NOT NULL,
+    credit INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    fingerprint INTEGER NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS transactions_day ON transactions (day);
+CREATE INDEX IF NOT EXISTS transactions_category ON transactions (category, month);
+CREATE INDEX IF NOT EXISTS transactions_source ON transactions (source);
+CREATE TABLE IF NOT EXISTS syncs (
+    spreadsheet_id TEXT PRIMARY KEY,
+    watermark INTEGER NOT NULL,
+    rows INTEGER NOT NULL
+);
+"""
+
+
+class Ledger():
+    """
+    SQLite ledger of the transactions, the source of truth of the sheet:
+    - day: day ordinal, month: year * 12 + month - 1
+    - debit, credit: amounts in cents
+    - fingerprint: identity of the transaction, see dedup.fingerprint
+
+    Arguments:
+    - path (str): database file
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ingest(self, rows, source=""):
+        """
+        Insert the transactions of an export, the ones already in the ledger are ignored
+
+        Arguments:
+        - rows (list): rows of an export without the headers, like get_data, typed or not
+        - source (str): account of the export
+
+        Returns:
+        - number of inserted transactions
+        """
+
+        def records():
+            for row, key in zip(rows, fingerprints(rows, source)):
+                # sqlite integers are signed
+                if key >= 1 << 63:
+                    key -= 1 << 64
+
+                yield (day_ordinal(row[0]), month_index(row[0]), row[1], row[2],
+                       amount_cents(row[3]), amount_cents(row[4]), source, key)
+
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO transactions "
+                "(day, month, description, category, debit, credit, source, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records()
+            )
+
+        return self.connection.total_changes - before
+
+    def monthly_totals(self, category=None, year=None):
+        """
+        Expenses and incomes per month
+
+        Arguments:
+        - category (str): value of a CATEGORY, None for all the categories
+        - year (int): year of the months, None for all the years
+
+        Returns:
+        - list of (month label, expenses in cents, incomes in cents)
+        """
+
+        query = "SELECT month, SUM(debit), SUM(credit) FROM transactions"
+        conditions, parameters = [], []
+
+        if category is not None:
+            conditions.append("category = ?")
+            parameters.append(category)
+        if year is not None:
+            conditions.append("day BETWEEN ? AND ?")
+            parameters.extend([date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        query += " GROUP BY month ORDER BY month"
+
+        return [(month_label(month), debit, credit)
+                for month, debit, credit in self.connection.execute(query, parameters)]
+
+    def values(self, after=0, typed=True):
+        """
+        Rows of the transactions inserted after an id, sorted by date, like get_data
+
+        Arguments:
+        - after (int): last id already read
+        - typed (bool): dates as google sheets serial numbers and amounts as numbers
+
+        Returns:
+        - list of (id, row)
+        """
+
+        cursor = self.connection.execute(
+            "SELECT id, day, description, category, debit, credit FROM transactions "
+            "WHERE id > ? ORDER BY day, id",
+            (after,)
+        )
+
+        rows = []
+        for id, day, description, category, debit, credit in cursor:
+            if typed:
+                row = typed_row(day, description, category, debit, credit)
+            else:
+                row = [date.fromordinal(day).strftime(DATE_FORMAT), description, category,
+                       format_amount(debit), format_amount(credit)]
+            rows.append((id, row))
+
+        return rows
+
+    def sync(self, service, spreadsheet_id, dashboard=None):
+        """
+        Append to the data sheet the transactions inserted since the last sync of the spreadsheet,
+        and extend the pivot tables to the new rows. The appended rows are sorted by date
+        between themselves, after the rows of the previous syncs. The first sync writes the whole
+        ledger from the top of the sheet, which may hold the rows of a full publish.
+
+        Arguments:
+        - service : google sheets service
+        - spreadsheet_id (str): id of the google spreadsheet
+        - dashboard (Dashboard): dashboard whose totals are computed again from the ledger, refreshed by the caller
+
+        Returns:
+        - dict with the number of appended rows and the labels of the months they change
+        """
+
+        state = self.connection.execute(
+            "SELECT watermark, rows FROM syncs WHERE spreadsheet_id = ?", (spreadsheet_id,)).fetchone()
+        watermark, rows_count = state or (0, 0)
+
+        new_rows = self.values(after=watermark)
+        if not new_rows:
+            return {"appended": 0, "months": []}
+
+        values = [row for _, row in new_rows]
+
+        # the manifest of the delta sync doesn't have the appended rows
+        forget_manifest(spreadsheet_id)
+
+        # the headers and the formatting are written by the first sync, an append would land
+        # after the rows already in the sheet
+        if rows_count == 0:
+            values.insert(0, HEADERS)
+            format_cells(service, spreadsheet_id)
+
+            execute_with_retry(service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range="data!A1",
+                valueInputOption="RAW",
+                body={"majorDimension": "ROWS", "values": values}
+            ))
+            execute_with_retry(service.spreadsheets().values().clear(
+                spreadsheetId=spreadsheet_id,
+                range=f"data!A{len(values) + 1}:E",
+                body={}
+            ))
+        else:
+            execute_with_retry(service.spreadsheets().values().append(
+                spreadsheetId=spreadsheet_id,
+                range=f"data!A{rows_count + 1}",
+                valueInputOption="RAW",
+                insertDataOption="OVERWRITE",
+                body={"majorDimension": "ROWS", "values": values}
+            ))
+        rows_count += len(values)
+
+        # the pivot tables only need their source range extended
+        create_pivot_tables(service, spreadsheet_id, rows_count, only_changed=True)
+
+        # the saved totals may come from other data, only the months which differ are written
+        if dashboard is not None:
+            rows = new_rows if watermark == 0 else self.values()
+            dashboard.replace([HEADERS] + [row for _, row in rows])
+
+        months = [month for month, in self.connection.execute(
+            "SELECT DISTINCT month FROM transactions WHERE id > ? ORDER BY month", (watermark,))]
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO syncs (spreadsheet_id, watermark, rows) VALUES (?, ?, ?)",
+                (spreadsheet_id, max(id for id, _ in new_rows), rows_count)
+            )
+
+        return {"appended": len(new_rows), "months": [month_label(month) for month in months]}
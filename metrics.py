@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+# json lines file of the metrics, set by configure or the EXPENSES_METRICS environment variable
+METRICS_FILE = os.environ.get("EXPENSES_METRICS")
+
+_lock = threading.Lock()
+_sink = None
+
+
+def configure(metrics_file):
+    """
+    Write the metrics in a json lines file
+
+    Arguments:
+    - metrics_file (str): file where the metrics are appended, None to disable the metrics
+    """
+    global METRICS_FILE, _sink
+
+    with _lock:
+        if _sink is not None:
+            _sink.close()
+            _sink = None
+        METRICS_FILE = metrics_file
+
+
+def enabled():
+    return METRICS_FILE is not None
+
+
+def emit(record):
+    """
+    Append a metric to the metrics file
+
+    Arguments:
+    - record (dict): metric, the time is added
+    """
+    global _sink
+
+    if METRICS_FILE is None:
+        return
+
+    line = json.dumps({"time": time.time(), **record})
+
+    with _lock:
+        if _sink is None:
+            _sink = open(METRICS_FILE, "a")
+        _sink.write(line + "\n")
+        _sink.flush()
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Time a phase of the pipeline
+
+    Arguments:
+    - name (str): name of the phase
+    - fields: extra values of the metric
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit({"type": "span", "name": name, "seconds": time.perf_counter() - start, **fields})
+
+
+def record_call(name, seconds, request_bytes, response_bytes, retries, status):
+    """
+    Record an api call
+
+    Arguments:
+    - name (str): api method
+    - seconds (float): latency with the retries
+    - request_bytes (int): size of the request body
+    - response_bytes (int): size of the response
+    - retries (int): number of retries
+    - status (int): http status of the last attempt
+    """
+    emit({"type": "call", "name": name, "seconds": seconds, "request_bytes": request_bytes,
+          "response_bytes": response_bytes, "retries": retries, "status": status})
+
+
+@contextmanager
+def profile(profile_file=None, trace_memory=False):
+    """
+    Profile a block with cProfile and/or tracemalloc
+
+    Arguments:
+    - profile_file (str): file where the cProfile stats are dumped, None to disable cProfile
+    - trace_memory (bool): record the peak of the python memory allocations as a metric
+    """
+
+    profiler = cProfile.Profile() if profile_file else None
+
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            emit({"type": "memory", "current_bytes": current, "peak_bytes": peak})
@@ -0,0 +1,257 @@
+from data_loader import DEFAULT_SOURCE, ExpenseTable, encode_row, load_file, map_row, read_rows
+from categories import get_rules
+
+from array import array
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+
+# parsed csv files, keyed by content
+CACHE_DIR = ".parse_cache"
+
+# size of the cache, the least recently used entries are evicted beyond it
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# entry layout: header (magic, version, number of rows, number of distinct items, bytes of the items),
+# then the native arrays debits (q), credits (q), dates (i), item indexes (i), item offsets (I),
+# categories (b) and the utf-8 items, the 8 bytes columns first so every column is aligned
+MAGIC = b"EXPTABLE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ")
+
+# bytes read at once to hash a file
+HASH_BLOCK = 1024 * 1024
+
+
+def file_hash(file):
+    """
+    Hash the content of a file
+
+    Arguments:
+    - file (str): file to hash
+
+    Returns:
+    - str hex digest
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file, "rb") as binary_file:
+        for block in iter(lambda: binary_file.read(HASH_BLOCK), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def parse_table(file, options=DEFAULT_SOURCE):
+    """
+    Parse a csv file into an ExpenseTable sorted by date, like data_loader.load_file
+
+    Arguments:
+    - file (str): csv file
+    - options (dict): csv format of the file, see data_loader.source_options
+
+    Returns:
+    - ExpenseTable
+    """
+
+    rows = (map_row(row, options) for row in read_rows(file, options["delimiter"]))
+
+    return ExpenseTable.from_rows(rows).sort()
+
+
+def write_table(path, table):
+    """
+    Write an ExpenseTable in the binary format of the cache, see read_table
+
+    Arguments:
+    - path (str): file to write
+    - table (ExpenseTable): table to store
+    """
+
+    # distinct items, the table stores an index per row
+    indexes = {}
+    item_indexes = array("i", (indexes.setdefault(item, len(indexes)) for item in table.items))
+
+    encoded = [item.encode() for item in indexes]
+    offsets = array("I", [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+
+    # write then rename, a concurrent run never reads a partial entry
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(table), len(encoded), offsets[-1]))
+        for column in (table.debits, table.credits, table.dates, item_indexes, offsets, table.categories):
+            column.tofile(file)
+        file.write(b"".join(encoded))
+
+    os.replace(path + ".tmp", path)
+
+
+def read_table(path):
+    """
+    Read an ExpenseTable written by write_table, the columns are copied out of a memory map of the file
+
+    Arguments:
+    - path (str): cache entry
+
+    Returns:
+    - ExpenseTable
+    """
+
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, version, _, rows, items, blob = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a cache entry of version {VERSION}")
+
+        view = memoryview(mapped)
+        position = HEADER.size
+
+        def column(typecode, count):
+            nonlocal position
+            values = array(typecode)
+            size = values.itemsize * count
+            values.frombytes(view[position:position + size])
+            position += size
+            return values
+
+        table = ExpenseTable()
+        table.debits = column("q", rows)
+        table.credits = column("q", rows)
+        table.dates = column("i", rows)
+        item_indexes = column("i", rows)
+        offsets = column("I", items + 1)
+        table.categories = column("b", rows)
+
+        text = view[position:position + blob].tobytes()
+        view.release()
+
+    distinct = [sys.intern(text[start:end].decode()) for start, end in zip(offsets, offsets[1:])]
+    table.items = list(map(distinct.__getitem__, item_indexes))
+
+    return table
+
+
+class ParseCache():
+    """
+    Content-addressed cache of the parsed csv files: an entry is keyed by the hash of the file,
+    its csv format and the fingerprint of the category rules, so a modified file or new rules
+    never hit an old entry. The entries of other rules are removed, and the least recently used
+    entries are evicted beyond the size of the cache.
+
+    Arguments:
+    - directory (str): directory of the entries
+    - max_bytes (int): size of the cache
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, file, options=DEFAULT_SOURCE):
+        """
+        Path of the entry of a file, named after the rules fingerprint and the key of the content
+        """
+
+        fingerprint = get_rules().fingerprint
+        csv_format = json.dumps([options["delimiter"], options["columns"], options["date_format"]])
+        key = hashlib.blake2b(f"{file_hash(file)}\x1f{csv_format}\x1f{VERSION}".encode(),
+                              digest_size=16).hexdigest()
+
+        return os.path.join(self.directory, f"{fingerprint}-{key}.tbl")
+
+    def load(self, file, options=DEFAULT_SOURCE):
+        """
+        Get the table of a csv file, parsed only if the cache has no entry for its content
+
+        Arguments:
+        - file (str): csv file
+        - options (dict): csv format of the file, see data_loader.source_options
+
+        Returns:
+        - ExpenseTable sorted by date, and True if it came from the cache
+        """
+
+        path = self.path(file, options)
+
+        if os.path.exists(path):
+            try:
+                table = read_table(path)
+            except (OSError, ValueError, struct.error):
+                # a corrupted entry is parsed again
+                pass
+            else:
+                # the modification time orders the entries for the eviction
+                os.utime(path)
+                return table, True
+
+        table = parse_table(file, options)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_table(path, table)
+        self.evict()
+
+        return table, False
+
+    def load_values(self, file, options=DEFAULT_SOURCE):
+        """
+        Get the typed rows of a csv file from the cache, used by data_loader.get_data_multi.
+        The rows are the ones of data_loader.load_file encoded by encode_row, with or without the cache.
+
+        Arguments:
+        - file (str): csv file
+        - options (dict): csv format of the file, see data_loader.source_options
+
+        Returns:
+        - typed rows sorted by date without the headers, and dict with the throughput of the file
+        """
+
+        start = time.perf_counter()
+        try:
+            table, cached = self.load(file, options)
+        except (ValueError, ArithmeticError):
+            # amounts which are not numbers can't be stored in the table, they are uploaded as text
+            values, stats = load_file(file, options)
+            return [encode_row(row) for row in values], stats
+
+        values = table.to_values(typed=True)[1:]
+
+        seconds = time.perf_counter() - start
+        stats = {"file": file, "rows": len(values), "seconds": seconds, "cached": cached,
+                 "rows_per_second": len(values) / seconds if seconds else 0}
+
+        return values, stats
+
+    def evict(self):
+        """
+        Remove the entries of other category rules, then the least recently used entries beyond the size of the cache
+        """
+
+        fingerprint = get_rules().fingerprint
+        entries = []
+
+        for path in glob.glob(os.path.join(self.directory, "*.tbl")):
+            try:
+                if not os.path.basename(path).startswith(fingerprint + "-"):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                # removed by a concurrent run
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
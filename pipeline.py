@@ -0,0 +1,135 @@
+from data_loader import HEADERS, get_data_chunks
+from utils import (CHUNK_SIZE, WORKERS, upload_rows, format_requests, pivot_requests, execute_with_retry, pooled_http,
+                   forget_manifest)
+from scheduler import PRIORITY_VALUES, PRIORITY_PIVOTS, PRIORITY_FORMAT
+import metrics
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+
+async def _parse(file, queue, chunk_size, workers, typed):
+    """
+    Parser stage: put the chunks of rows with their start row in the queue, then one None per upload worker
+
+    Returns:
+    - number of rows, headers included
+    """
+
+    loop = asyncio.get_running_loop()
+    chunks = get_data_chunks(file, chunk_size, typed=typed)
+
+    # row 0 is the headers
+    start_row = 1
+
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+        if chunk is None:
+            break
+
+        # waits while the queue is full, the parser never runs far ahead of the uploads
+        await queue.put((start_row, chunk))
+        start_row += len(chunk)
+
+    for _ in range(workers):
+        await queue.put(None)
+
+    return start_row
+
+
+async def _upload(service, spreadsheet_id, queue, executor, input_option):
+    """
+    Upload stage: send the chunks of the queue until a None
+    """
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+
+        start_row, rows = item
+        await loop.run_in_executor(executor, upload_rows, service, spreadsheet_id, start_row, rows, input_option)
+
+
+def _send(service, request, priority=PRIORITY_VALUES):
+    # the http object of the service is not thread safe
+    with pooled_http(service) as http:
+        return execute_with_retry(request, http=http, priority=priority)
+
+
+async def _batch_update(service, spreadsheet_id, requests, executor, priority):
+    loop = asyncio.get_running_loop()
+    request = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests})
+    await loop.run_in_executor(executor, _send, service, request, priority)
+
+
+async def _run(service, spreadsheet_id, file, chunk_size, workers, queue_size, typed):
+    queue = asyncio.Queue(maxsize=queue_size)
+    input_option = "RAW" if typed else "USER_ENTERED"
+
+    with ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        loop = asyncio.get_running_loop()
+
+        # remove the old rows, the new data may be shorter
+        clear = service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id, range="data", body={})
+        await loop.run_in_executor(executor, _send, service, clear)
+
+        # the headers and the formatting don't depend on the rows
+        headers = loop.run_in_executor(executor, upload_rows, service, spreadsheet_id, 0, [HEADERS], input_option)
+        formatting = asyncio.ensure_future(
+            _batch_update(service, spreadsheet_id, format_requests(), executor, PRIORITY_FORMAT))
+
+        async def parse_then_pivots():
+            rows_count = await _parse(file, queue, chunk_size, workers, typed)
+
+            # the pivot tables only need the number of rows, known when the parsing is done
+            await _batch_update(service, spreadsheet_id, pivot_requests(rows_count), executor,
+                                PRIORITY_PIVOTS)
+            return rows_count
+
+        parser = asyncio.ensure_future(parse_then_pivots())
+        uploads = [asyncio.ensure_future(_upload(service, spreadsheet_id, queue, executor, input_option))
+                   for _ in range(workers)]
+        tasks = [parser, headers, formatting] + uploads
+
+        # the parser and the uploads are awaited together: when the uploads fail for good nothing
+        # drains the queue anymore, the parser is cancelled instead of waiting forever for room in it
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    return parser.result()
+
+
+def run_pipeline(service, spreadsheet_id, file, chunk_size=CHUNK_SIZE, workers=WORKERS, queue_size=None, typed=True):
+    """
+    Parse a csv file and upload its chunks of rows at the same time, the format and pivot tables
+    are sent as soon as they can be. The queue between the parser and the uploads is bounded,
+    so the memory holds at most queue_size chunks.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - file: csv file which contains all the data
+    - chunk_size (int): number of rows per upload
+    - workers (int): number of concurrent uploads
+    - queue_size (int): maximum number of parsed chunks waiting for an upload, None for 2 per worker
+    - typed (bool): upload typed dates and amounts with RAW input
+
+    Returns:
+    - number of rows, headers included
+    """
+
+    if queue_size is None:
+        queue_size = 2 * workers
+
+    # the rows are streamed, the next delta sync writes them all again
+    forget_manifest(spreadsheet_id)
+
+    with metrics.span("pipeline", file=str(file)):
+        return asyncio.run(_run(service, spreadsheet_id, file, chunk_size, workers, queue_size, typed))
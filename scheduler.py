@@ -0,0 +1,156 @@
+from collections import OrderedDict, deque
+import threading
+import time
+
+import metrics
+
+
+# priority lanes, lower first: the values before the pivot tables before the cosmetic formatting
+PRIORITY_VALUES = 0
+PRIORITY_PIVOTS = 1
+PRIORITY_FORMAT = 2
+
+# default quotas of the google sheets api per user
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+BURST = 10
+
+
+class TokenBucket():
+    """
+    Token bucket refilled at a constant rate
+
+    Arguments:
+    - rate (float): tokens per second
+    - capacity (int): maximum number of tokens, the size of a burst
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        Seconds until a token is available, 0 if there is one
+        """
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def drain(self):
+        """
+        Remove the tokens, after a quota error
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class RequestScheduler():
+    """
+    Schedule the api calls of the process within the read and write quotas:
+    - a token bucket per kind of request
+    - priority lanes, see PRIORITY_VALUES, PRIORITY_PIVOTS and PRIORITY_FORMAT
+    - the spreadsheets of a lane take turns, so a big upload doesn't starve the other spreadsheets
+
+    Arguments:
+    - reads_per_minute (int): read quota
+    - writes_per_minute (int): write quota
+    - burst (int): requests of a kind which can be sent at once
+    """
+
+    def __init__(self, reads_per_minute=READS_PER_MINUTE, writes_per_minute=WRITES_PER_MINUTE, burst=BURST):
+        self.buckets = {
+            "read": TokenBucket(reads_per_minute / 60, burst),
+            "write": TokenBucket(writes_per_minute / 60, burst),
+        }
+
+        # kind -> priority -> spreadsheet id -> waiting tickets
+        self.lanes = {kind: {} for kind in self.buckets}
+        self.condition = threading.Condition()
+
+        self.throttle_seconds = 0.0
+        self.requests = 0
+
+    def depth(self):
+        """
+        Number of requests waiting for their turn
+        """
+        with self.condition:
+            return sum(len(tickets) for lanes in self.lanes.values()
+                       for spreadsheets in lanes.values() for tickets in spreadsheets.values())
+
+    def stats(self):
+        """
+        Queue depth, number of scheduled requests and total time spent waiting for a turn
+        """
+        return {"depth": self.depth(), "requests": self.requests, "throttle_seconds": self.throttle_seconds}
+
+    def _head(self, kind):
+        lanes = self.lanes[kind]
+        for priority in sorted(lanes):
+            for spreadsheet_id, tickets in lanes[priority].items():
+                return priority, spreadsheet_id, tickets[0]
+        return None
+
+    def acquire(self, kind, spreadsheet_id, priority=PRIORITY_VALUES):
+        """
+        Wait for the turn of a request
+
+        Arguments:
+        - kind (str): "read" or "write"
+        - spreadsheet_id (str): spreadsheet of the request
+        - priority (int): lane of the request
+        """
+
+        ticket = object()
+        start = time.monotonic()
+        bucket = self.buckets[kind]
+
+        with self.condition:
+            lane = self.lanes[kind].setdefault(priority, OrderedDict())
+            lane.setdefault(spreadsheet_id, deque()).append(ticket)
+
+            while True:
+                head = self._head(kind)
+                if head[2] is ticket:
+                    wait = bucket.wait_time()
+                    if wait == 0:
+                        break
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+
+            bucket.take()
+
+            # the spreadsheet goes to the end of the lane
+            tickets = lane.pop(spreadsheet_id)
+            tickets.popleft()
+            if tickets:
+                lane[spreadsheet_id] = tickets
+            if not lane:
+                del self.lanes[kind][priority]
+
+            waited = time.monotonic() - start
+            self.throttle_seconds += waited
+            self.requests += 1
+            self.condition.notify_all()
+
+        metrics.emit({"type": "schedule", "kind": kind, "priority": priority, "spreadsheet_id": spreadsheet_id,
+                      "waited": waited, "depth": self.depth()})
+
+    def penalize(self, kind):
+        """
+        Slow down the requests of a kind after a quota error
+        """
+        with self.condition:
+            self.buckets[kind].drain()
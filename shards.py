@@ -0,0 +1,154 @@
+from data_loader import HEADERS, month_index
+from utils import (BatchBuilder, execute_with_retry, row_hash, values_requests, format_requests, pivot_requests,
+                   forget_manifest)
+
+import hashlib
+import json
+import os
+
+
+# sheet ids of the tabs of each year
+SHARDS_FILE = "shards.json"
+
+
+def shard_sheet_ids(year):
+    """
+    Sheet ids of the data and pivot tables tabs of a year
+
+    Arguments:
+    - year (int): year of the shard
+
+    Returns:
+    - data sheet id, pivot tables sheet id
+    """
+    return 10000 + 2 * year, 10001 + 2 * year
+
+
+def row_year(row):
+    """
+    Year of a row of get_data, with a typed or a dd/mm/yyyy date
+    """
+    return month_index(row[0]) // 12
+
+
+def split_by_year(data):
+    """
+    Split the data into one table per year, each with the headers
+
+    Arguments:
+    - data (list): headers and rows sorted by date
+
+    Returns:
+    - dict of the data of each year
+    """
+
+    years = {}
+    for row in data[1:]:
+        years.setdefault(row_year(row), [HEADERS]).append(row)
+
+    return years
+
+
+def load_shards(spreadsheet_id, shards_file=SHARDS_FILE):
+    """
+    Load the shards of a spreadsheet
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - shards_file (str): json manifest of the shards
+
+    Returns:
+    - dict keyed by year (str) with the sheet ids and the hash of the rows of each shard
+    """
+
+    if not os.path.exists(shards_file):
+        return {}
+
+    with open(shards_file) as file:
+        return json.load(file).get(spreadsheet_id, {})
+
+
+def save_shards(spreadsheet_id, shards, shards_file=SHARDS_FILE):
+    """
+    Save the shards of a spreadsheet
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - shards (dict): shards of the spreadsheet, see load_shards
+    - shards_file (str): json manifest of the shards
+    """
+
+    manifest = {}
+    if os.path.exists(shards_file):
+        with open(shards_file) as file:
+            manifest = json.load(file)
+
+    manifest[spreadsheet_id] = shards
+
+    with open(shards_file, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+
+def _shard_hash(rows):
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(row_hash(row).encode())
+    return digest.hexdigest()
+
+
+def publish_sharded(service, spreadsheet_id, data, shards_file=SHARDS_FILE):
+    """
+    Publish the data in one data tab and one pivot tables tab per year. The tabs of a new year
+    are created on demand, and only the years whose rows changed are written,
+    so the pivot tables of the other years are not recomputed.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - data (list): headers and rows sorted by date
+
+    Returns:
+    - list of the written years
+    """
+
+    # the delta sync of the spreadsheet doesn't know the new layout
+    forget_manifest(spreadsheet_id)
+
+    shards = load_shards(spreadsheet_id, shards_file)
+    years = split_by_year(data)
+
+    # tabs of the new years
+    new_years = [year for year in years if str(year) not in shards]
+    if new_years:
+        requests = []
+        for year in new_years:
+            data_id, pivots_id = shard_sheet_ids(year)
+            requests.append({"addSheet": {"properties": {"sheetId": data_id, "title": f"data_{year}"}}})
+            requests.append({"addSheet": {"properties": {"sheetId": pivots_id, "title": f"pivot_tables_{year}"}}})
+            shards[str(year)] = {"data": data_id, "pivot_tables": pivots_id, "hash": None}
+
+        execute_with_retry(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                              body={"requests": requests}))
+        save_shards(spreadsheet_id, shards, shards_file)
+
+    # rewrite only the years which changed
+    batch = BatchBuilder(service, spreadsheet_id)
+    written = []
+
+    for year, rows in sorted(years.items()):
+        shard = shards[str(year)]
+        shard_hash = _shard_hash(rows)
+        if shard["hash"] == shard_hash:
+            continue
+
+        batch.add(values_requests(rows, shard["data"]))
+        batch.add(format_requests(shard["data"]))
+        batch.add(pivot_requests(rows, shard["pivot_tables"], shard["data"]))
+
+        shard["hash"] = shard_hash
+        written.append(year)
+
+    batch.flush()
+    save_shards(spreadsheet_id, shards, shards_file)
+
+    return written
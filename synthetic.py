@@ -0,0 +1,115 @@
+from categories import DEFAULT_RULES
+from data_loader import DATE_FORMAT
+
+from datetime import date
+from itertools import accumulate
+import argparse
+import random
+
+
+# headers of the csv files, like the example of the README
+CSV_HEADERS = "Date;Item;debit;credit"
+
+# rows written at once
+WRITE_BATCH = 10000
+
+
+def merchants(count):
+    """
+    Names of the merchants: the keywords of the category rules first, then numbered variants
+    which only the substring rules or the default category match
+
+    Arguments:
+    - count (int): number of distinct merchants
+
+    Returns:
+    - list of names
+    """
+
+    keywords = [keyword.capitalize() for rule in DEFAULT_RULES
+                for keyword in rule.get("exact", []) + rule.get("contains", [])]
+
+    names = keywords[:count]
+    for index in range(len(names), count):
+        names.append(f"{keywords[index % len(keywords)]} {index}")
+
+    return names
+
+
+def generate_ledger(file, rows, merchant_count=100, comma_decimals=True, disorder=0.0, descending=True,
+                    years=10, seed=0):
+    """
+    Write a deterministic semicolon-delimited ledger, in the format of the README
+
+    Arguments:
+    - file (str): csv file to write
+    - rows (int): number of transactions
+    - merchant_count (int): number of distinct descriptions, the first ones are the most frequent
+    - comma_decimals (bool): amounts like "72,55" instead of "72.55"
+    - disorder (float): share of the transactions moved to a random date, out of order
+    - descending (bool): newest transactions first, like the bank exports
+    - years (int): number of years covered by the transactions
+    - seed (int): seed of the random generator, the same arguments always write the same file
+    """
+
+    generator = random.Random(seed)
+    names = merchants(merchant_count)
+
+    # the merchants of the income rules credit the account
+    income_keywords = {keyword for rule in DEFAULT_RULES if rule["category"] == "Income"
+                       for keyword in rule.get("exact", [])}
+    incomes = {name for name in names if name.split(" ")[0].lower() in income_keywords}
+
+    # zipf-like popularity of the merchants
+    weights = list(accumulate(1 / (rank + 1) for rank in range(len(names))))
+
+    first_day = date(2010, 1, 1).toordinal()
+    days = years * 365
+    separator = "," if comma_decimals else "."
+
+    # date strings are reused, there are only a few thousand days
+    labels = {}
+
+    def label(ordinal):
+        text = labels.get(ordinal)
+        if text is None:
+            text = labels[ordinal] = date.fromordinal(ordinal).strftime(DATE_FORMAT)
+        return text
+
+    with open(file, "w", newline="") as csv_file:
+        csv_file.write(CSV_HEADERS + "\n")
+
+        for start in range(0, rows, WRITE_BATCH):
+            lines = []
+            for index in range(start, min(start + WRITE_BATCH, rows)):
+                position = rows - 1 - index if descending else index
+                day = first_day + position * days // max(rows, 1)
+                if disorder and generator.random() < disorder:
+                    day = first_day + generator.randrange(days)
+
+                name = generator.choices(names, cum_weights=weights)[0]
+                amount = f"{generator.randint(1, 500)}{separator}{generator.randint(0, 99):02d}"
+
+                if name in incomes:
+                    lines.append(f"{label(day)};{name};;{amount}\n")
+                else:
+                    lines.append(f"{label(day)};{name};{amount};\n")
+
+            csv_file.writelines(lines)
+
+
+if __name__ == "__main__":
+
+    # command line arguments
+    parser = argparse.ArgumentParser(description="Generate a synthetic ledger of expenses")
+    parser.add_argument("file", help="csv file to write")
+    parser.add_argument("--rows", type=int, default=10000, help="number of transactions")
+    parser.add_argument("--merchants", type=int, default=100, help="number of distinct descriptions")
+    parser.add_argument("--dot-decimals", action="store_true", help="amounts like 72.55 instead of 72,55")
+    parser.add_argument("--disorder", type=float, default=0.0, help="share of the transactions out of order")
+    parser.add_argument("--ascending", action="store_true", help="oldest transactions first")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    args = parser.parse_args()
+
+    generate_ledger(args.file, args.rows, args.merchants, not args.dot_decimals, args.disorder,
+                    not args.ascending, seed=args.seed)
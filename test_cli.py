@@ -0,0 +1,7 @@
+from cli import check_import_time
+
+
+def test_import_time():
+    # the local-only commands import within the budget and without the google client
+    result = check_import_time()
+    assert result["ok"], result
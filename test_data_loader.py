@@ -0,0 +1,47 @@
+from data_loader import (HEADERS, amount_cents, day_ordinal, encode_row, get_data, get_data_chunks, month_index,
+                         parse_amount)
+from synthetic import generate_ledger
+
+import pytest
+
+
+@pytest.mark.parametrize("value, cents", [
+    ("72,55", 7255),
+    ("72.55", 7255),
+    ("1.234,56", 123456),
+    ("1,234.56", 123456),
+    ("1 234,56", 123456),
+    ("1.234.567", 123456700),
+    ("-3,5", -350),
+    ("", 0),
+])
+def test_parse_amount(value, cents):
+    assert parse_amount(value) == cents
+
+
+def test_encode_row_amounts():
+    assert encode_row(["01/01/2023", "Shop", "Other", "1.234,56", ""]) == [44927, "Shop", "Other", 1234.56, ""]
+
+    # an amount which is not a number is uploaded as text instead of stopping the run
+    assert encode_row(["01/01/2023", "Shop", "Other", "12 EUR", ""]) == [44927, "Shop", "Other", "12 EUR", ""]
+
+
+def test_typed_and_text_values():
+    # the helpers read the same transaction uploaded typed or as text
+    text = ["05/09/2022", "Bar", "Entertainment", "7,8", ""]
+    typed = encode_row(text)
+
+    assert day_ordinal(typed[0]) == day_ordinal(text[0])
+    assert month_index(typed[0]) == month_index(text[0]) == 2022 * 12 + 8
+    assert amount_cents(typed[3]) == amount_cents(text[3]) == 780
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_chunks_external_sort(tmp_path, typed):
+    # runs smaller than the file are spilled on disk and merged
+    file = str(tmp_path / "expenses.csv")
+    generate_ledger(file, 5000, seed=1)
+
+    rows = [row for chunk in get_data_chunks(file, chunk_size=700, run_size=1000, typed=typed) for row in chunk]
+
+    assert [HEADERS] + rows == get_data(file, typed=typed)
@@ -0,0 +1,21 @@
+from data_loader import get_data
+from dedup import DedupIndex, MAX_LOAD, MIN_CAPACITY, fingerprints
+from synthetic import generate_ledger
+
+
+def test_index_grows_and_reopens(tmp_path):
+    path = str(tmp_path / "dedup.idx")
+    generate_ledger(str(tmp_path / "expenses.csv"), 3 * MIN_CAPACITY, seed=1)
+    keys = list(fingerprints(get_data(str(tmp_path / "expenses.csv"))[1:]))
+
+    with DedupIndex(path) as index:
+        assert all(index.add(key) for key in keys)
+        assert not any(index.add(key) for key in keys)
+        assert index.capacity > MIN_CAPACITY
+        assert len(index) <= index.capacity * MAX_LOAD
+
+    # the fingerprints are read back from the file
+    with DedupIndex(path) as index:
+        assert len(index) == len(keys)
+        assert all(key in index for key in keys)
+        assert not index.add(keys[0])
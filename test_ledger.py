@@ -0,0 +1,47 @@
+from conftest import sheet_rows
+from data_loader import get_data
+from ledger import Ledger
+from synthetic import generate_ledger
+from utils import publish
+
+import os
+
+import update_sheets
+
+
+def _export(file, days):
+    # one expense of 10 per day of september 2022
+    with open(file, "w") as csv_file:
+        csv_file.write("Date;Item;debit;credit\n")
+        for day in days:
+            csv_file.write(f"{day:02d}/09/2022;Groceries;{day * 10},00;\n")
+
+
+def test_overlapping_exports(service, spreadsheet_id, monkeypatch):
+    monkeypatch.setattr(update_sheets, "create_authorized_service", lambda **kwargs: service)
+    os.mkdir("inbox")
+
+    _export("inbox/a.csv", range(1, 21))
+    update_sheets.update(spreadsheet_id, mode="ledger", path="inbox")
+
+    # the second export repeats the last days of the first one
+    _export("inbox/b.csv", range(11, 31))
+    update_sheets.update(spreadsheet_id, mode="ledger", path="inbox")
+
+    with Ledger() as ledger:
+        assert ledger.monthly_totals() == [("2022-09", sum(range(1, 31)) * 1000, 0)]
+    assert len(sheet_rows(service, spreadsheet_id)) == 31
+
+
+def test_first_sync_over_publish(service, spreadsheet_id):
+    generate_ledger("expenses.csv", 3000, seed=1)
+    data = get_data("expenses.csv", typed=True)
+
+    # a bigger sheet published by another mode
+    publish(service, spreadsheet_id, data + data[1:])
+
+    with Ledger() as ledger:
+        ledger.ingest(data[1:])
+        ledger.sync(service, spreadsheet_id)
+
+    assert len(sheet_rows(service, spreadsheet_id)) == 3001
@@ -0,0 +1,38 @@
+from data_loader import get_data_multi
+from dedup import DedupIndex
+from parse_cache import ParseCache
+from synthetic import generate_ledger
+
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_cached_rows_are_the_parsed_rows(tmp_path, monkeypatch, typed):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("inbox")
+    generate_ledger("inbox/a.csv", 2000, seed=1)
+    generate_ledger("inbox/b.csv", 2000, seed=2)
+
+    expected = get_data_multi("inbox", typed=typed)
+    cache = ParseCache()
+
+    # the first run fills the cache, the second one reads it
+    assert get_data_multi("inbox", typed=typed, cache=cache) == expected
+    assert get_data_multi("inbox", typed=typed, cache=cache) == expected
+
+
+def test_cached_rows_with_dedup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("inbox")
+    generate_ledger("inbox/a.csv", 2000, seed=1)
+    generate_ledger("inbox/b.csv", 2000, seed=1)
+
+    with DedupIndex(None) as index:
+        expected = get_data_multi("inbox", typed=True, dedup=index)
+    with DedupIndex(None) as index:
+        assert get_data_multi("inbox", typed=True, dedup=index, cache=ParseCache()) == expected
+
+    # the second file repeats the first one
+    assert len(expected) == 2001
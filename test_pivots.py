@@ -0,0 +1,45 @@
+from utils import pivot_requests
+
+
+def _request(column, row, pivot_rows, values, columns=None):
+    # envelope of the hand-written requests of create_pivot_tables, before PIVOTS
+    pivot = {
+        "source": {"sheetId": 2, "startRowIndex": 0, "endRowIndex": 101, "startColumnIndex": 0, "endColumnIndex": 5},
+        "rows": pivot_rows,
+    }
+    if columns:
+        pivot["columns"] = columns
+    pivot["values"] = values
+    pivot["valueLayout"] = "HORIZONTAL"
+
+    return {
+        "updateCells": {
+            "rows": {"values": [{"pivotTable": pivot}]},
+            "start": {"sheetId": 1, "rowIndex": row, "columnIndex": column},
+            "fields": "pivotTable",
+        }
+    }
+
+
+def test_pivot_requests_match_hand_written():
+    # the requests compiled from PIVOTS are the ones written by hand before
+    expenses = [{"summarizeFunction": "SUM", "sourceColumnOffset": 3}]
+    both = expenses + [{"summarizeFunction": "SUM", "sourceColumnOffset": 4}]
+    by_year = {"sourceColumnOffset": 0, "showTotals": False, "sortOrder": "ASCENDING",
+               "groupRule": {"dateTimeRule": {"type": "YEAR"}}}
+    by_month = {"sourceColumnOffset": 0, "showTotals": False, "sortOrder": "ASCENDING",
+                "groupRule": {"dateTimeRule": {"type": "YEAR_MONTH"}}}
+
+    expected = [
+        _request(0, 0, [{"sourceColumnOffset": 2, "showTotals": False, "sortOrder": "ASCENDING", "valueBucket": {}}],
+                 expenses),
+        _request(3, 0, [{"sourceColumnOffset": 1, "showTotals": False, "sortOrder": "ASCENDING", "valueBucket": {}}],
+                 expenses),
+        _request(6, 0, [by_year], both),
+        _request(0, 40, [by_month], both),
+        _request(6, 40, [by_month], expenses,
+                 columns=[{"sourceColumnOffset": 2, "showTotals": False, "sortOrder": "ASCENDING"}]),
+    ]
+
+    assert pivot_requests(101) == expected
+    assert pivot_requests([None] * 101) == expected
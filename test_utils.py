@@ -0,0 +1,60 @@
+from conftest import sheet_rows
+from data_loader import get_data, get_data_multi
+from fake_sheets import FakeSheetsService
+from googleapiclient.errors import HttpError
+from pipeline import run_pipeline
+from synthetic import generate_ledger
+from utils import changed_pivots, create_sheet, forget_manifest, pivot_requests, publish, sync_values
+
+import os
+
+import pytest
+
+
+def test_delta_sync_after_pipeline(service, spreadsheet_id):
+    # a full write by another mode makes the next delta sync write all the rows
+    os.mkdir("inbox")
+    generate_ledger("inbox/a.csv", 4000, seed=1)
+    generate_ledger("inbox/b.csv", 3000, seed=2)
+    generate_ledger("other.csv", 3000, seed=3)
+
+    data = get_data_multi("inbox", typed=True)
+    sync_values(service, spreadsheet_id, data)
+    assert len(sheet_rows(service, spreadsheet_id)) == 7001
+
+    run_pipeline(service, spreadsheet_id, "other.csv")
+    assert len(sheet_rows(service, spreadsheet_id)) == 3001
+
+    sync_values(service, spreadsheet_id, data)
+    assert sheet_rows(service, spreadsheet_id) == data
+
+
+def test_sync_values_over_publish(service, spreadsheet_id):
+    # without a manifest, the first delta sync rewrites the published rows instead of appending them again
+    generate_ledger("expenses.csv", 3000, seed=1)
+    data = get_data("expenses.csv", typed=True)
+    publish(service, spreadsheet_id, data + data[1:])
+    forget_manifest(spreadsheet_id)
+
+    sync_values(service, spreadsheet_id, data)
+    assert sheet_rows(service, spreadsheet_id) == data
+
+
+def test_no_changed_pivots_after_publish(service, spreadsheet_id):
+    generate_ledger("expenses.csv", 3000, seed=1)
+    data = get_data("expenses.csv", typed=True)
+    publish(service, spreadsheet_id, data)
+
+    assert changed_pivots(service, spreadsheet_id, pivot_requests(data)) == []
+    assert changed_pivots(service, spreadsheet_id, pivot_requests(len(data) + 1)) != []
+
+
+def test_pipeline_fails_on_payload_too_large(tmp_path, monkeypatch):
+    # a request rejected by the api stops the pipeline instead of leaving the parser waiting
+    monkeypatch.chdir(tmp_path)
+    service = FakeSheetsService(max_payload=2000)
+    spreadsheet_id = create_sheet(service)["spreadsheetId"]
+    generate_ledger("expenses.csv", 20000, seed=1)
+
+    with pytest.raises(HttpError):
+        run_pipeline(service, spreadsheet_id, "expenses.csv", chunk_size=500)
@@ -0,0 +1,18 @@
+from verify import block_hashes, diff_tree, hash_tree
+
+import pytest
+
+
+ROWS = [[45000 + index, f"item {index}", "Food", index, ""] for index in range(1000)]
+
+
+@pytest.mark.parametrize("changed", [[], [0], [999], [300, 301, 700], list(range(0, 1000, 100))])
+def test_diff_tree(changed):
+    remote = [list(row) for row in ROWS]
+    for index in changed:
+        remote[index][3] += 1
+
+    local_tree = hash_tree(block_hashes(ROWS, block_size=64))
+    remote_tree = hash_tree(block_hashes(remote, block_size=64))
+
+    assert diff_tree(local_tree, remote_tree) == sorted({index // 64 for index in changed})
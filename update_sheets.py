@@ -1,22 +1,245 @@
-from utils import create_authorized_service, update_values, format_cells, create_pivot_tables
-from data_loader import get_data
+from utils import create_authorized_service, publish, sync_values, format_cells, create_pivot_tables, set_scheduler
+from data_loader import get_data, get_data_multi, ExpenseTable
+from aggregate import summarize, summary_values
+from pipeline import run_pipeline
+from dedup import DedupIndex
+from ledger import Ledger
+from shards import publish_sharded
+from watch import watch
+from verify import verify
+from parse_cache import ParseCache
+from dashboard import Dashboard
+from scheduler import RequestScheduler, READS_PER_MINUTE, WRITES_PER_MINUTE
+import metrics
+import argparse
+import json
+import os
+
+
+def load_data(path, sources=None, typed=False, dedup=False, cache=None, verbose=True):
+    """
+    Get the data of a csv file, or of several csv files merged by date
+
+    Arguments:
+    - path (str): csv file, directory or glob pattern
+    - sources (dict): csv formats keyed by glob pattern of the file name
+    - typed (bool): dates as google sheets serial numbers and amounts as numbers
+    - dedup (bool): drop the transactions repeated by overlapping exports
+    - cache (ParseCache): reuse the parsed files whose content didn't change when typed, None to parse them all
+    - verbose (bool): print the throughput of each file
+
+    Returns:
+    - data
+    """
+
+    # a single file has nothing to merge or dedup
+    if os.path.isfile(path) and not sources and (cache is None or not typed):
+        return get_data(path, typed)
+
+    stats = []
+    if not dedup:
+        data = get_data_multi(path, sources, typed=typed, cache=cache, stats=stats)
+    else:
+        # the whole sheet is rewritten, so the index only holds the transactions of this run
+        with DedupIndex(None) as index:
+            data = get_data_multi(path, sources, typed=typed, dedup=index, cache=cache, stats=stats)
+
+    if verbose:
+        for file_stats in stats:
+            print(f"{file_stats['file']}: {file_stats['rows']} rows in {file_stats['seconds']:.3f}s "
+                  f"({file_stats['rows_per_second']:.0f} rows/s{', cached' if file_stats.get('cached') else ''})")
+
+    return data
+
+
+def update(spreadsheet_id, mode="publish", compress=False, path="expenses.csv", sources=None, dedup=False,
+           cache=None):
+    """
+    Update the google sheets with the expenses
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - mode (str):
+        - "publish": send the data, formatting and pivot tables in a single batch
+        - "delta": send only the rows which changed since the last sync
+        - "static": write summaries computed locally instead of the pivot tables
+        - "pipeline": parse and upload a single csv file at the same time
+        - "ledger": store the transactions in the local ledger and append the new ones to the sheet
+        - "sharded": one data and pivot tables tab per year, only the changed years are written
+        - "watch": follow the csv files and append their new lines in micro-batches, until interrupted
+        - "verify": compare the data sheet with the csv files, reading back only the date and amount columns
+        - "repair": verify, then rewrite the rows of the mismatching blocks
+    - compress (bool): gzip the request bodies
+    - path (str): csv file, directory or glob pattern of the bank exports
+    - sources (dict): csv formats keyed by glob pattern of the file name
+    - dedup (bool): drop the transactions repeated by overlapping exports
+    - cache (ParseCache): reuse the parsed files whose content didn't change
+    """
 
-if __name__ == "__main__":
-    
     # create a sheets service
-    service = create_authorized_service()
+    service = create_authorized_service(compress=compress)
+
+    # totals of each month of the dashboard tab
+    dashboard = Dashboard(spreadsheet_id)
+
+    if mode == "delta":
+        # get the data from csv files, with typed dates and amounts
+        data = load_data(path, sources, typed=True, dedup=dedup, cache=cache)
+
+        # insert only the new and changed rows
+        changes = sync_values(service, spreadsheet_id, data)
+
+        # the formatting and pivot tables only need to be updated when the number of rows changed
+        if changes["resized"]:
+            format_cells(service, spreadsheet_id)
+            create_pivot_tables(service, spreadsheet_id, data, only_changed=True)
+
+        dashboard.replace(data)
+
+    elif mode == "static":
+        # compute the summaries locally
+        table = ExpenseTable.from_values(load_data(path, sources, typed=True, dedup=dedup, cache=cache))
+        data = table.to_values(typed=True)
+        summaries = summary_values(summarize(table))
+
+        # insert the data, format the cells and write the summaries in a single batch
+        publish(service, spreadsheet_id, data, summaries)
+
+        dashboard.replace(data)
+
+    elif mode == "ledger":
+        # the ledger ignores the transactions it already has, but fingerprints the merged files
+        # as a single export: the days repeated by overlapping files are dropped before
+        data = load_data(path, sources, typed=True, dedup=True, cache=cache)
+
+        with Ledger() as ledger:
+            ledger.ingest(data[1:])
+            ledger.sync(service, spreadsheet_id, dashboard)
+
+    elif mode == "sharded":
+        # get the data from csv files, with typed dates and amounts
+        data = load_data(path, sources, typed=True, dedup=dedup, cache=cache)
+
+        # write the tabs of the years which changed
+        publish_sharded(service, spreadsheet_id, data)
+
+        dashboard.replace(data)
+
+    elif mode == "watch":
+        # parse only the lines appended to the files
+        watch(service, spreadsheet_id, path, sources, dashboard=dashboard)
+
+    elif mode in ("verify", "repair"):
+        # get the data from csv files, with typed dates and amounts
+        data = load_data(path, sources, typed=True, dedup=dedup, cache=cache)
+
+        # compare the hashes of the blocks of rows, then fix the blocks which differ
+        report = verify(service, spreadsheet_id, data, repair=mode == "repair")
+        print(f"{len(report['mismatched'])} of {report['blocks']} blocks differ, {report['repaired']} rows repaired")
+
+    elif mode == "pipeline":
+        # upload the chunks of rows while the next ones are parsed
+        run_pipeline(service, spreadsheet_id, path)
+
+    else:
+        # get the data from csv files, with typed dates and amounts
+        data = load_data(path, sources, typed=True, dedup=dedup, cache=cache)
+
+        # insert the data, format the cells and create the pivot tables in a single batch
+        publish(service, spreadsheet_id, data)
+
+        dashboard.replace(data)
+
+    # rewrite only the months which changed
+    if dashboard.dirty:
+        dashboard.refresh(service)
+
+
+def add_arguments(parser):
+    """
+    Add the options of the update to a command line parser, shared with cli.py
+
+    Arguments:
+    - parser (argparse.ArgumentParser): parser of the command
+    """
+
+    parser.add_argument("--input", default="expenses.csv", help="csv file, directory or glob pattern of the bank exports")
+    parser.add_argument("--sources", help="json file with the csv formats keyed by glob pattern of the file name")
+    parser.add_argument("--dedup", action="store_true", help="drop the transactions repeated by overlapping exports")
+    parser.add_argument("--delta", action="store_true", help="send only the rows which changed since the last sync")
+    parser.add_argument("--static-summaries", action="store_true",
+                        help="write summaries computed locally instead of the pivot tables")
+    parser.add_argument("--ledger", action="store_true",
+                        help="store the transactions in the local ledger and append the new ones to the sheet")
+    parser.add_argument("--sharded", action="store_true",
+                        help="one data and pivot tables tab per year, for a sheet created with --sharded")
+    parser.add_argument("--pipeline", action="store_true", help="parse and upload a single csv file at the same time")
+    parser.add_argument("--watch", action="store_true",
+                        help="follow the csv file or the inbox directory and append the new lines to the sheet")
+    parser.add_argument("--verify", action="store_true",
+                        help="check that the data sheet matches the csv files, without downloading it all")
+    parser.add_argument("--repair", action="store_true", help="verify, then rewrite only the rows which differ")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse all the csv files, instead of reusing the ones parsed by a previous run")
+    parser.add_argument("--gzip", action="store_true", help="compress the request bodies")
+    parser.add_argument("--writes-per-minute", type=int, default=WRITES_PER_MINUTE,
+                        help="write quota of the api calls, 0 to disable the rate limiting")
+    parser.add_argument("--reads-per-minute", type=int, default=READS_PER_MINUTE, help="read quota of the api calls")
+    parser.add_argument("--metrics", help="json lines file where the timings and api calls are recorded")
+    parser.add_argument("--profile", help="file where the cProfile stats are dumped")
+    parser.add_argument("--trace-memory", action="store_true", help="record the peak memory with tracemalloc")
+
+
+def main(args):
+    """
+    Update the google sheets with the parsed command line options, see add_arguments
+    """
+
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    # api calls within the quotas
+    if args.writes_per_minute:
+        set_scheduler(RequestScheduler(args.reads_per_minute, args.writes_per_minute))
+
+    sources = None
+    if args.sources:
+        with open(args.sources) as file:
+            sources = json.load(file)
 
     # Your spreadsheet id
     spreadsheet_id = "YOUR_ID"
 
-    # get the data from csv file
-    data = get_data("expenses.csv")
+    with metrics.profile(args.profile, args.trace_memory):
+        if args.delta:
+            mode = "delta"
+        elif args.static_summaries:
+            mode = "static"
+        elif args.ledger:
+            mode = "ledger"
+        elif args.sharded:
+            mode = "sharded"
+        elif args.pipeline:
+            mode = "pipeline"
+        elif args.watch:
+            mode = "watch"
+        elif args.repair:
+            mode = "repair"
+        elif args.verify:
+            mode = "verify"
+        else:
+            mode = "publish"
+
+        # the parsed exports are reused while their content and the category rules don't change
+        cache = None if args.no_cache else ParseCache()
+
+        update(spreadsheet_id, mode, args.gzip, args.input, sources, args.dedup, cache)
 
-    # insert the data in the google sheets 
-    update_values(service, spreadsheet_id, data)
 
-    # format the cells of the google sheets 
-    format_cells(service, spreadsheet_id)
+if __name__ == "__main__":
+
+    # command line arguments
+    parser = argparse.ArgumentParser(description="Update the google sheets with the expenses")
+    add_arguments(parser)
 
-    # create pivot tables
-    create_pivot_tables(service, spreadsheet_id, data)
\ No newline at end of file
+    main(parser.parse_args())
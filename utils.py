@@ -1,64 +1,159 @@
-# google libraries
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+import hashlib
+import json
 import os
+import random
+import re
+import threading
+import time
+
+from aggregate import SUMMARY_ANCHORS
+from data_loader import DATE_FORMAT, SERIAL_EPOCH, parse_amount
+import metrics
+from scheduler import PRIORITY_VALUES, PRIORITY_PIVOTS, PRIORITY_FORMAT
 
 # scopes
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
+# upload
+CHUNK_SIZE = 5000
+WORKERS = 4
+
+# retries of quota and server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF = 1.0
+
+# payload limit of a batchUpdate call
+MAX_BATCH_BYTES = 2_000_000
+
+# request bodies bigger than this are gzip compressed when compression is enabled
+GZIP_MIN_BYTES = 1024
+
+# pivot tables of the sheet 1, the offsets are the columns of the data:
+# - anchor: row and column index of the pivot table
+# - rows, columns: grouped columns, with an optional date grouping of the rows
+# - values: summed columns
+PIVOTS = [
+    {"anchor": (0, 0), "rows": [2], "values": [3]},
+    {"anchor": (0, 3), "rows": [1], "values": [3]},
+    {"anchor": (0, 6), "rows": [0], "group": "YEAR", "values": [3, 4]},
+    {"anchor": (40, 0), "rows": [0], "group": "YEAR_MONTH", "values": [3, 4]},
+    {"anchor": (40, 6), "rows": [0], "group": "YEAR_MONTH", "columns": [2], "values": [3]},
+]
+
+# local state of the delta sync
+MANIFEST_FILE = "sync_manifest.json"
+
+# authorization
+TOKEN_FILE = "token.json"
+CREDENTIALS_FILE = "credentials.json"
+REFRESH_MARGIN = 300
+
+# services and idle http objects of the process
+HTTP_TIMEOUT = 60
+_services = {}
+_http_pool = {}
+_services_lock = threading.Lock()
+
+# quota scheduler of the api calls, see set_scheduler
+_scheduler = None
+
 
 # ----- functions ---------
 
-def create_authorized_service():
+def value_input_option(data):
     """
-    Create an authorized service for google sheets using a personal credentials.json file
+    Choose how google sheets reads the values: typed data (see data_loader.encode_rows)
+    is stored as is, string data is parsed like user input
+
+    Arguments:
+    - data (list): headers and rows
 
     Returns:
-    - service: Google Sheets service
+    - "RAW" or "USER_ENTERED"
     """
-    creds = None
 
-    # The file token.json stores the user's access and refresh tokens
-    # It is created automatically when the authorization flow completes for the first time
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+    if len(data) > 1 and not isinstance(data[1][0], str):
+        return "RAW"
 
-    # Check if there are no credentials available
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
+    return "USER_ENTERED"
 
-        # save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
 
+def create_authorized_service(token_file=TOKEN_FILE, credentials_file=CREDENTIALS_FILE, compress=False):
+    """
+    Create an authorized service for google sheets using a personal credentials.json file.
+    The service is created once per process and token file, then reused.
 
-    try:
-        # create sheets service
-        service = build("sheets", "v4", credentials=creds)
+    Arguments:
+    - token_file (str): file with the access and refresh tokens
+    - credentials_file (str): credentials of the google cloud project
+    - compress (bool): gzip the request bodies
+
+    Returns:
+    - service: Google Sheets service
+    """
+
+    with _services_lock:
+        if (token_file, compress) in _services:
+            return _services[token_file, compress]
+
+        # the google client is only imported by the commands which talk to the api
+        import client
+
+        service = client.build_service(token_file, credentials_file, compress)
+        if service is not None:
+            _services[token_file, compress] = service
 
-        # console log for the user
-        print("Sheets service created successfully")
-        
         return service
 
-    except HttpError as err:
-        print(err)
+
+@contextmanager
+def pooled_http(service):
+    """
+    Borrow an authorized http object from the pool of the process, httplib2 is not thread safe.
+    The http objects keep their connections alive, so concurrent uploads reuse them between calls.
+
+    Arguments:
+    - service : google sheets service
+
+    Returns:
+    - http object, or None to use the http object of the service
+    """
+
+    credentials = getattr(getattr(service, "_http", None), "credentials", None)
+    if credentials is None:
+        yield None
+        return
+
+    with _services_lock:
+        idle = _http_pool.setdefault(credentials, [])
+        http = idle.pop() if idle else None
+
+    if http is None:
+        # only a real service has credentials, the google client is already loaded
+        import client
+        http = client.authorized_http(credentials, client.is_compressed(service))
+
+    try:
+        yield http
+    finally:
+        with _services_lock:
+            idle.append(http)
 
 
-def create_sheet(service):
+def create_sheet(service, sharded=False):
     """
     Create a google spreadsheet using an authorized sheets service
 
     Arguments:
     - service: authorized google sheets service
+    - sharded (bool): create only the dashboard, the tabs of each year are added on demand (see shards.py)
+
+    Returns:
+    - created google spreadsheet
     """
     
     # sheet body used for the google sheet
@@ -88,8 +183,11 @@ def create_sheet(service):
         ]
     }
 
+    if sharded:
+        sheet_body["sheets"] = sheet_body["sheets"][:1]
+
     # google sheets file
-    sheets_file = service.spreadsheets().create(body=sheet_body).execute()
+    sheets_file = execute_with_retry(service.spreadsheets().create(body=sheet_body))
 
     # console log
     message_user = f"""Created sheet:
@@ -98,272 +196,709 @@ def create_sheet(service):
 
     print(message_user)
 
+    return sheets_file
 
 
-def update_values(service, spreadsheet_id, data):
+
+class UploadError(Exception):
+    """
+    Raised when a chunk can't be uploaded, next_chunk is the start_chunk to resume the upload
+    """
+
+    def __init__(self, next_chunk, error):
+        super().__init__(f"upload failed, resume from chunk {next_chunk}: {error}")
+        self.next_chunk = next_chunk
+        self.error = error
+
+
+def set_scheduler(scheduler):
     """
-    Update the values of the google spreadsheets
+    Send all the api calls through a quota scheduler
+
+    Arguments:
+    - scheduler (RequestScheduler): scheduler of the process, None to send the calls right away
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+
+def _request_kind(request):
+    method = getattr(request, "methodId", "")
+    return "read" if method.endswith((".get", ".batchGet")) else "write"
+
+
+def _request_spreadsheet(request):
+    match = re.search(r"/spreadsheets/([^/:?]+)", getattr(request, "uri", ""))
+    return match.group(1) if match else ""
+
+
+def execute_with_retry(request, retries=MAX_RETRIES, backoff=BACKOFF, http=None, priority=PRIORITY_VALUES):
+    """
+    Execute a request, retrying quota and server errors with exponential backoff and jitter
+
+    Arguments:
+    - request : google api request
+    - retries (int): maximum number of retries
+    - backoff (float): delay in seconds before the first retry, doubled after each retry
+    - http : http object used to execute the request, None for the default one
+    - priority (int): lane of the request in the scheduler, see scheduler.py
+
+    Returns:
+    - response of the request
+    """
+
+    # imported here, utils is also used by the local-only commands
+    from googleapiclient.errors import HttpError
+
+    start = time.perf_counter()
+    status = None
+
+    try:
+        for attempt in range(retries + 1):
+            if _scheduler is not None:
+                _scheduler.acquire(_request_kind(request), _request_spreadsheet(request), priority)
+
+            try:
+                response = request.execute(http=http)
+                status = 200
+                return response
+
+            except HttpError as err:
+                status = err.resp.status
+                if status == 429 and _scheduler is not None:
+                    _scheduler.penalize(_request_kind(request))
+                if status not in RETRY_STATUSES or attempt == retries:
+                    raise
+
+            except (ConnectionError, TimeoutError):
+                if attempt == retries:
+                    raise
+
+            # full jitter
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+    finally:
+        if metrics.enabled():
+            body = getattr(request, "body", None) or ""
+            metrics.record_call(getattr(request, "methodId", type(request).__name__),
+                                time.perf_counter() - start,
+                                len(body),
+                                len(json.dumps(response)) if status == 200 else 0,
+                                attempt,
+                                status)
+
+
+def upload_rows(service, spreadsheet_id, start_row, rows, input_option="USER_ENTERED"):
+    """
+    Write rows in the data sheet with a pooled http object, safe to call from several threads
+
+    Arguments:
+    - service : service google sheets
+    - spreadsheet_id (str): id of the google spreadsheet
+    - start_row (int): index of the first row, 0 for the headers
+    - rows (list): rows to write
+    - input_option (str): "RAW" or "USER_ENTERED", see value_input_option
+    """
+
+    body = {
+        "valueInputOption": input_option,
+        "data": [
+            {
+                "range": f"data!A{start_row + 1}",
+                "majorDimension": "ROWS",
+                "values": rows
+            }
+        ]
+    }
+    request = service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body)
+
+    with pooled_http(service) as http:
+        execute_with_retry(request, http=http)
+
+
+def update_values(service, spreadsheet_id, data, chunk_size=CHUNK_SIZE, workers=WORKERS, start_chunk=0):
+    """
+    Update the values of the google spreadsheets, in chunks of rows uploaded concurrently
 
     Arguments:
     - service : service google sheets
     - spreadsheet_id (str): id of the google spreadsheet
     - data (list): headers and rows to store in the google sheets
+    - chunk_size (int): number of rows per request
+    - workers (int): number of concurrent requests
+    - start_chunk (int): first chunk to upload, to resume a failed upload (see UploadError)
+
+    Returns:
+    - number of chunks
     """
 
-    range = "data!A1"
+    chunks = range(0, len(data), chunk_size)
+    input_option = value_input_option(data)
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        valueInputOption="USER_ENTERED",
-        range=range,
-        body={"majorDimension": "ROWS", "values": data}
-    ).execute()
+    def upload_chunk(index):
+        start = chunks[index]
+        upload_rows(service, spreadsheet_id, start, data[start:start + chunk_size], input_option)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(upload_chunk, index): index for index in range(start_chunk, len(chunks))}
+
+        for future in as_completed(futures):
+            if future.exception() is None:
+                continue
+
+            # stop the pending chunks and wait for the running ones
+            executor.shutdown(wait=True, cancel_futures=True)
+            acknowledged = {index for done, index in futures.items()
+                            if not done.cancelled() and done.exception() is None}
+
+            # resume after the chunks acknowledged without gap
+            next_chunk = start_chunk
+            while next_chunk in acknowledged:
+                next_chunk += 1
+
+            raise UploadError(next_chunk, future.exception()) from future.exception()
+
+    return len(chunks)
+
+
+def row_hash(row):
+    """
+    Hash the content of a row
+
+    Arguments:
+    - row (list): values of the row
+
+    Returns:
+    - str short hex digest
+    """
+    return hashlib.blake2b("\x1f".join(map(str, row)).encode(), digest_size=8).hexdigest()
+
+
+def load_manifest(spreadsheet_id, manifest_file=MANIFEST_FILE):
+    """
+    Load the hashes of the rows synced in a spreadsheet
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - manifest_file (str): json file of the last sync
+
+    Returns:
+    - list of row hashes, empty if the spreadsheet was never synced
+    """
+
+    if not os.path.exists(manifest_file):
+        return []
+
+    with open(manifest_file) as file:
+        manifest = json.load(file)
+
+    if manifest.get("spreadsheet_id") != spreadsheet_id:
+        return []
+
+    return manifest["hashes"]
+
+
+def save_manifest(spreadsheet_id, hashes, manifest_file=MANIFEST_FILE):
+    """
+    Save the hashes of the rows synced in a spreadsheet
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - hashes (list): hash of each synced row
+    - manifest_file (str): json file of the last sync
+    """
+
+    with open(manifest_file, "w") as file:
+        json.dump({"spreadsheet_id": spreadsheet_id, "rows": len(hashes), "hashes": hashes}, file)
+
+
+def forget_manifest(spreadsheet_id, manifest_file=MANIFEST_FILE):
+    """
+    Remove the manifest of a spreadsheet before its data sheet is written by something else than sync_values,
+    the next delta sync then writes all the rows
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - manifest_file (str): json file of the last sync
+    """
+
+    if load_manifest(spreadsheet_id, manifest_file):
+        os.remove(manifest_file)
+
+
+def sync_values(service, spreadsheet_id, data, manifest_file=MANIFEST_FILE):
+    """
+    Update only the rows which changed since the last sync:
+    - new rows at the end are appended
+    - changed rows are updated by range
+    - rows which disappeared are cleared
+    A transaction inserted in the middle of the data shifts the next rows, which are updated.
+    Without a manifest the sheet may hold the rows of a full publish, the first sync writes all the rows
+    from the top and clears the rows after them.
+
+    Arguments:
+    - service : service google sheets
+    - spreadsheet_id (str): id of the google spreadsheet
+    - data (list): headers and rows to store in the google sheets
+    - manifest_file (str): json file of the last sync
+
+    Returns:
+    - dict with the number of appended, updated and cleared rows, and resized if the number of rows changed
+    """
+
+    old_hashes = load_manifest(spreadsheet_id, manifest_file)
+    hashes = [row_hash(row) for row in data]
+    synced = min(len(old_hashes), len(hashes))
+
+    # group the changed rows in contiguous ranges
+    ranges = []
+    for index in range(synced):
+        if hashes[index] == old_hashes[index]:
+            continue
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+
+    if ranges:
+        body = {
+            "valueInputOption": value_input_option(data),
+            "data": [
+                {
+                    "range": f"data!A{start + 1}",
+                    "majorDimension": "ROWS",
+                    "values": data[start:end]
+                }
+                for start, end in ranges
+            ]
+        }
+        execute_with_retry(service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+
+    # first sync, an append would land after the rows already in the sheet
+    if not old_hashes:
+        execute_with_retry(service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range="data!A1",
+            valueInputOption=value_input_option(data),
+            body={"majorDimension": "ROWS", "values": data}
+        ))
+        execute_with_retry(service.spreadsheets().values().clear(
+            spreadsheetId=spreadsheet_id,
+            range=f"data!A{len(data) + 1}:E",
+            body={}
+        ))
+
+    # new rows after the last synced one
+    elif len(data) > synced:
+        execute_with_retry(service.spreadsheets().values().append(
+            spreadsheetId=spreadsheet_id,
+            range=f"data!A{synced + 1}",
+            valueInputOption=value_input_option(data),
+            insertDataOption="OVERWRITE",
+            body={"majorDimension": "ROWS", "values": data[synced:]}
+        ))
+
+    # rows which are not in the data anymore
+    if len(old_hashes) > len(data):
+        execute_with_retry(service.spreadsheets().values().clear(
+            spreadsheetId=spreadsheet_id,
+            range=f"data!A{len(data) + 1}:E{len(old_hashes)}",
+            body={}
+        ))
+
+    save_manifest(spreadsheet_id, hashes, manifest_file)
+
+    return {
+        "appended": len(data) - synced,
+        "updated": sum(end - start for start, end in ranges),
+        "cleared": max(len(old_hashes) - len(data), 0),
+        "resized": len(old_hashes) != len(data)
+    }
+
+
+def to_cell(value, column=None):
+    """
+    Convert a value of the data into a google sheets cell, dates and amounts are sent as numbers
+
+    Arguments:
+    - value: value of the cell
+    - column (int): column of the value in the data, None for a value outside the data
+
+    Returns:
+    - dict CellData
+    """
+
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+
+    if value == "":
+        return {}
+
+    try:
+        if column == 0:
+            serial = datetime.strptime(value, DATE_FORMAT).toordinal() - SERIAL_EPOCH
+            return {"userEnteredValue": {"numberValue": serial}}
+
+        if column in (3, 4):
+            return {"userEnteredValue": {"numberValue": parse_amount(value) / 100}}
+
+    except (ValueError, ArithmeticError):
+        pass
+
+    return {"userEnteredValue": {"stringValue": value}}
+
+
+def values_requests(data, sheetId=2, chunk_size=CHUNK_SIZE):
+    """
+    Requests replacing the values of the sheet 2 by the data
+
+    Arguments:
+    - data (list): headers and rows to store in the google sheets
+    - sheetId (int): id of the sheet where store the data
+    - chunk_size (int): number of rows per request
 
+    Returns:
+    - list of requests
+    """
+
+    # clear the old values, then append the rows after the last row with data
+    requests = [
+        {
+            "updateCells": {
+                "range": {"sheetId": sheetId},
+                "fields": "userEnteredValue"
+            }
+        },
+        {
+            "appendCells": {
+                "sheetId": sheetId,
+                "rows": [{"values": [{"userEnteredValue": {"stringValue": str(value)}} for value in data[0]]}],
+                "fields": "userEnteredValue"
+            }
+        }
+    ]
+
+    for start in range(1, len(data), chunk_size):
+        requests.append({
+            "appendCells": {
+                "sheetId": sheetId,
+                "rows": [{"values": [to_cell(value, column) for column, value in enumerate(row)]}
+                         for row in data[start:start + chunk_size]],
+                "fields": "userEnteredValue"
+            }
+        })
+
+    return requests
+
+
+def summary_requests(values, sheetId=1):
+    """
+    Requests replacing the pivot tables of the sheet 1 by precomputed summaries
+
+    Arguments:
+    - values (dict): tables of aggregate.summary_values
+    - sheetId (int): id of the sheet where store the summaries
+
+    Returns:
+    - list of requests
+    """
+
+    # remove the pivot tables and the old values
+    requests = [
+        {
+            "updateCells": {
+                "range": {"sheetId": sheetId},
+                "fields": "*"
+            }
+        }
+    ]
+
+    for name, row_index, column_index in SUMMARY_ANCHORS:
+        requests.append({
+            "updateCells": {
+                "rows": [{"values": [to_cell(value) for value in row]} for row in values[name]],
+                "start": {
+                    "sheetId": sheetId,
+                    "rowIndex": row_index,
+                    "columnIndex": column_index
+                },
+                "fields": "userEnteredValue"
+            }
+        })
+
+    return requests
+
+
+class BatchBuilder():
+    """
+    Collect requests and send them in as few spreadsheets().batchUpdate calls as the payload limit allows
+    """
+
+    def __init__(self, service, spreadsheet_id, max_bytes=MAX_BATCH_BYTES):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.max_bytes = max_bytes
+        self.requests = []
+        self.size = 0
+        self.calls = 0
+
+    def add(self, requests):
+        """
+        Add requests to the batch, the pending ones are sent first if the batch gets too large
+
+        Arguments:
+        - requests (list): requests of a spreadsheets().batchUpdate
+        """
+
+        for request in requests:
+            size = len(json.dumps(request))
+
+            if self.requests and self.size + size > self.max_bytes:
+                self.flush()
+
+            self.requests.append(request)
+            self.size += size
+
+    def flush(self):
+        """
+        Send the pending requests
+        """
+
+        if not self.requests:
+            return
+
+        body = {"requests": self.requests}
+        execute_with_retry(self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body))
+
+        self.requests = []
+        self.size = 0
+        self.calls += 1
+
+
+def publish(service, spreadsheet_id, data, summaries=None, only_changed=False, manifest_file=MANIFEST_FILE):
+    """
+    Update the values, the formatting and the pivot tables of the google spreadsheet
+    in a single batchUpdate when the payload allows it. The manifest of the delta sync
+    is replaced by the hashes of the written rows.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - data (list): headers and rows to store in the google sheets
+    - summaries (dict): tables of aggregate.summary_values written instead of the pivot tables, None for pivot tables
+    - only_changed (bool): send only the pivot tables which differ from the ones of the sheet, at the cost of a read
+    - manifest_file (str): json file of the last sync
 
-def create_pivot_tables(service, spreadsheet_id, data, sheetId=1,sheetId_source=2):
+    Returns:
+    - number of batchUpdate calls
+    """
+
+    # a failed publish leaves no manifest of the old rows
+    forget_manifest(spreadsheet_id, manifest_file)
+
+    batch = BatchBuilder(service, spreadsheet_id)
+    batch.add(values_requests(data))
+    batch.add(format_requests())
+    if summaries is None:
+        pivots = pivot_requests(data)
+        if only_changed:
+            pivots = changed_pivots(service, spreadsheet_id, pivots)
+        batch.add(pivots)
+    else:
+        batch.add(summary_requests(summaries))
+    batch.flush()
+
+    save_manifest(spreadsheet_id, [row_hash(row) for row in data], manifest_file)
+
+    return batch.calls
+
+
+def create_pivot_tables(service, spreadsheet_id, data, sheetId=1,sheetId_source=2, only_changed=False):
     """
     Create the pivot tables in the sheet 1
 
     Arguments:
     - service : google sheets service
     - spreadsheet_id (string): id of the google spreadsheet
+    - data (list or int): headers and rows of the source sheet, or only their number
     - sheetId (int) : if of the sheet where store the pivot tables
+    - only_changed (bool): send only the pivot tables which differ from the ones of the sheet
+
+    Returns:
+    - number of pivot tables sent
     """
 
-    requests = {
-        "requests": [
-            {
-                "updateCells": {
-                    "rows": {
-                        "values": [
-                            {
-                                "pivotTable": {
-                                    "source": {
-                                        "sheetId": sheetId_source,
-                                        "startRowIndex": 0,
-                                        "endRowIndex": len(data),
-                                        "startColumnIndex": 0,
-                                        "endColumnIndex":5
-                                    },
-                                    "rows":[
-                                        {
-                                            "sourceColumnOffset": 2,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING",
-                                            "valueBucket": {}
-                                        }
-                                    ],
-                                    "values":[
-                                            {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 3
-                                        }
-                                    ],
-                                    "valueLayout" : "HORIZONTAL"
-                                }
-                            }
-                        ]
-                    },
-                    "start": {
-                        "sheetId": sheetId,
-                        "rowIndex": 0,
-                        "columnIndex": 0
-                    },
-                    "fields": "pivotTable"
-                }
-            },
-            {
-                "updateCells": {
-                    "rows": {
-                        "values": [
-                            {
-                                "pivotTable": {
-                                    "source": {
-                                        "sheetId": sheetId_source,
-                                        "startRowIndex": 0,
-                                        "endRowIndex": len(data),
-                                        "startColumnIndex": 0,
-                                        "endColumnIndex":5
-                                    },
-                                    "rows":[
-                                        {
-                                            "sourceColumnOffset": 1,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING",
-                                            "valueBucket": {}
-                                        }
-                                    ],
-                                    "values":[
-                                            {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 3
-                                        }
-                                    ],
-                                    "valueLayout" : "HORIZONTAL"
-                                }
-                            }
-                        ]
-                    },
-                    "start": {
-                        "sheetId": sheetId,
-                        "rowIndex": 0,
-                        "columnIndex": 3
-                    },
-                    "fields": "pivotTable"
-                }
-            },
-            {
-                "updateCells": {
-                    "rows": {
-                        "values": [
-                            {
-                                "pivotTable": {
-                                    "source": {
-                                        "sheetId": sheetId_source,
-                                        "startRowIndex": 0,
-                                        "endRowIndex": len(data),
-                                        "startColumnIndex": 0,
-                                        "endColumnIndex":5
-                                    },
-                                    "rows":[
-                                        {
-                                            "sourceColumnOffset": 0,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING",
-                                            "groupRule":{
-                                                "dateTimeRule":{
-                                                    "type": "YEAR"
-                                                }
-                                            }
-                                        }
-                                    ],
-                                    "values":[
-                                        {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 3
-                                        },
-                                        {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 4
-                                        }
-                                    ],
-                                    "valueLayout" : "HORIZONTAL"
-                                }
-                            }
-                        ]
-                    },
-                    "start": {
-                        "sheetId": sheetId,
-                        "rowIndex": 0,
-                        "columnIndex": 6
-                    },
-                    "fields": "pivotTable"
-                }
-            },
-            {
-                "updateCells": {
-                    "rows": {
-                        "values": [
-                            {
-                                "pivotTable": {
-                                    "source": {
-                                        "sheetId": sheetId_source,
-                                        "startRowIndex": 0,
-                                        "endRowIndex": len(data),
-                                        "startColumnIndex": 0,
-                                        "endColumnIndex":5
-                                    },
-                                    "rows":[
-                                        {
-                                            "sourceColumnOffset": 0,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING",
-                                            "groupRule":{
-                                                "dateTimeRule":{
-                                                    "type": "YEAR_MONTH"
-                                                }
-                                            }
-                                        }
-                                    ],
-                                    "values":[
-                                        {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 3
-                                        },
-                                        {
-                                            "summarizeFunction": "SUM",
-                                            "sourceColumnOffset": 4
-                                        }
-                                    ],
-                                    "valueLayout" : "HORIZONTAL"
-                                }
-                            }
-                        ]
-                    },
-                    "start": {
-                        "sheetId": sheetId,
-                        "rowIndex": 40,
-                        "columnIndex": 0
-                    },
-                    "fields": "pivotTable"
-                }
-            },
-            {
-                "updateCells":{
-                    "rows":{
-                        "values":[
-                            {
-                                "pivotTable":{
-                                    "source":{
-                                        "sheetId": sheetId_source,
-                                        "startRowIndex": 0,
-                                        "endRowIndex": len(data),
-                                        "startColumnIndex": 0,
-                                        "endColumnIndex": 5
-                                    },
-                                    "rows":[
-                                        {
-                                            "sourceColumnOffset": 0,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING",
-                                            "groupRule":{
-                                                "dateTimeRule":{
-                                                    "type": "YEAR_MONTH"
-                                                }
-                                            }
-                                        },
-                                       
-                                    ],
-                                    "columns": [
-                                        {
-                                            "sourceColumnOffset": 2,
-                                            "showTotals": False,
-                                            "sortOrder": "ASCENDING"
-                                        }
-                                    ],
-                                    "values":[
-                                        {
-                                            "sourceColumnOffset": 3,
-                                            "summarizeFunction": "SUM"
-                                        }
-                                    ],
-                                    "valueLayout" : "HORIZONTAL"
-                                }
-                            }
-                        ]
-                    },
-                    "start":{
-                        "sheetId": sheetId,
-                        "rowIndex": 40,
-                        "columnIndex": 6
-                    },
-                    "fields": "pivotTable"
-                }
-            }
+    pivots = pivot_requests(data, sheetId, sheetId_source)
+
+    if only_changed:
+        pivots = changed_pivots(service, spreadsheet_id, pivots)
+
+    if pivots:
+        requests = {"requests": pivots}
+        execute_with_retry(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=requests),
+                           priority=PRIORITY_PIVOTS)
+
+    return len(pivots)
+
+
+def compile_pivot(spec, rows_count, sheetId=1, sheetId_source=2):
+    """
+    Compile a pivot table spec of PIVOTS into an updateCells request
+
+    Arguments:
+    - spec (dict): pivot table spec
+    - rows_count (int): number of rows of the source sheet, headers included
+    - sheetId (int) : id of the sheet where store the pivot table
+    - sheetId_source (int) : id of the sheet with the data
+
+    Returns:
+    - updateCells request
+    """
+
+    rows = []
+    for offset in spec["rows"]:
+        group = {
+            "sourceColumnOffset": offset,
+            "showTotals": False,
+            "sortOrder": "ASCENDING"
+        }
+        if "group" in spec:
+            group["groupRule"] = {"dateTimeRule": {"type": spec["group"]}}
+        else:
+            group["valueBucket"] = {}
+        rows.append(group)
+
+    pivot_table = {
+        "source": {
+            "sheetId": sheetId_source,
+            "startRowIndex": 0,
+            "endRowIndex": rows_count,
+            "startColumnIndex": 0,
+            "endColumnIndex": 5
+        },
+        "rows": rows,
+        "values": [{"summarizeFunction": "SUM", "sourceColumnOffset": offset} for offset in spec["values"]],
+        "valueLayout": "HORIZONTAL"
+    }
+
+    if "columns" in spec:
+        pivot_table["columns"] = [
+            {"sourceColumnOffset": offset, "showTotals": False, "sortOrder": "ASCENDING"}
+            for offset in spec["columns"]
         ]
+
+    row_index, column_index = spec["anchor"]
+
+    return {
+        "updateCells": {
+            "rows": {"values": [{"pivotTable": pivot_table}]},
+            "start": {
+                "sheetId": sheetId,
+                "rowIndex": row_index,
+                "columnIndex": column_index
+            },
+            "fields": "pivotTable"
+        }
     }
 
-    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=requests).execute()
+
+def pivot_requests(data, sheetId=1, sheetId_source=2):
+    """
+    Requests creating the pivot tables in the sheet 1
+
+    Arguments:
+    - data (list or int): headers and rows of the source sheet, or only their number
+    - sheetId (int) : id of the sheet where store the pivot tables
+    - sheetId_source (int) : id of the sheet with the data
+
+    Returns:
+    - list of requests
+    """
+
+    # the appends only know the number of rows, the pivot tables need nothing else
+    rows_count = data if isinstance(data, int) else len(data)
+
+    return [compile_pivot(spec, rows_count, sheetId, sheetId_source) for spec in PIVOTS]
+
+
+def _normalize_pivot(value):
+    """
+    Drop the empty and default values of a pivot table, which the api doesn't send back:
+    empty objects and lists, False, 0, and the default value layout
+    """
+
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            item = _normalize_pivot(item)
+            if item in ({}, [], None, "", 0) or (key, item) == ("valueLayout", "HORIZONTAL"):
+                continue
+            normalized[key] = item
+        return normalized
+
+    if isinstance(value, list):
+        return [_normalize_pivot(item) for item in value]
+
+    return value
+
+
+def current_pivots(service, spreadsheet_id, sheet_title="pivot_tables"):
+    """
+    Get the pivot tables of a sheet, without its values
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (string): id of the google spreadsheet
+    - sheet_title (str): title of the sheet with the pivot tables
+
+    Returns:
+    - dict of the pivot tables keyed by (row index, column index)
+    """
+
+    response = execute_with_retry(service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        ranges=[sheet_title],
+        fields="sheets(data(startRow,startColumn,rowData(values(pivotTable))))"
+    ))
+
+    pivots = {}
+    for sheet in response.get("sheets", []):
+        for grid in sheet.get("data", []):
+            start_row, start_column = grid.get("startRow", 0), grid.get("startColumn", 0)
+            for row_offset, row in enumerate(grid.get("rowData", [])):
+                for column_offset, cell in enumerate(row.get("values", [])):
+                    if "pivotTable" in cell:
+                        pivots[start_row + row_offset, start_column + column_offset] = cell["pivotTable"]
+
+    return pivots
+
+
+def changed_pivots(service, spreadsheet_id, requests, sheet_title="pivot_tables"):
+    """
+    Keep the pivot table requests which would change the sheet
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (string): id of the google spreadsheet
+    - requests (list): updateCells requests of pivot_requests
+    - sheet_title (str): title of the sheet with the pivot tables
+
+    Returns:
+    - list of requests
+    """
+
+    pivots = current_pivots(service, spreadsheet_id, sheet_title)
+
+    changed = []
+    for request in requests:
+        start = request["updateCells"]["start"]
+        pivot_table = request["updateCells"]["rows"]["values"][0]["pivotTable"]
+        current = pivots.get((start["rowIndex"], start["columnIndex"]))
+
+        if current is None or _normalize_pivot(current) != _normalize_pivot(pivot_table):
+            changed.append(request)
+
+    return changed
 
 
 def format_cells(service, spreadsheet_id, sheetId=2):
@@ -376,6 +911,23 @@ def format_cells(service, spreadsheet_id, sheetId=2):
     - sheetId (int): id of the sheet where apply the formatting
     """
 
+    requests = {"requests": format_requests(sheetId)}
+
+    execute_with_retry(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=requests),
+                       priority=PRIORITY_FORMAT)
+
+
+def format_requests(sheetId=2):
+    """
+    Requests setting a custom datetime and format for a range in the sheet 2
+
+    Arguments:
+    - sheetId (int): id of the sheet where apply the formatting
+
+    Returns:
+    - list of requests
+    """
+
     requests = {
         "requests": [
             {
@@ -465,4 +1017,4 @@ def format_cells(service, spreadsheet_id, sheetId=2):
         ]
     }
 
-    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=requests).execute()
\ No newline at end of file
+    return requests["requests"]
@@ -0,0 +1,229 @@
+from data_loader import HEADERS
+from utils import execute_with_retry, row_hash, forget_manifest
+
+import hashlib
+
+
+# rows of the data sheet per hashed block
+BLOCK_SIZE = 256
+
+# columns read back by default: the date and the amounts are numbers, cheap to transfer,
+# and a manual edit of an amount is the drift which matters
+VERIFY_COLUMNS = "ADE"
+
+
+def _column_ranges(columns):
+    """
+    Group the columns into contiguous ranges, "ADE" -> ["A:A", "D:E"]
+    """
+
+    indexes = sorted(ord(column) - ord("A") for column in columns.upper())
+
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+
+    return [f"{chr(ord('A') + start)}:{chr(ord('A') + end)}" for start, end in ranges]
+
+
+def _normalize(value):
+    # the api returns 41 for the 41.0 which was sent, and nothing for an empty cell
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _select(row, indexes):
+    return [_normalize(row[index]) if index < len(row) else "" for index in indexes]
+
+
+def block_hashes(rows, block_size=BLOCK_SIZE):
+    """
+    Hash the rows by blocks
+
+    Arguments:
+    - rows (list): rows without the headers
+    - block_size (int): number of rows per block
+
+    Returns:
+    - list of the hex digests of the blocks
+    """
+
+    hashes = []
+    for start in range(0, len(rows), block_size):
+        digest = hashlib.blake2b(digest_size=16)
+        for row in rows[start:start + block_size]:
+            digest.update(row_hash(row).encode())
+        hashes.append(digest.hexdigest())
+
+    return hashes
+
+
+def hash_tree(leaves):
+    """
+    Build a merkle tree over the hashes of the blocks
+
+    Arguments:
+    - leaves (list): hashes of the blocks, see block_hashes
+
+    Returns:
+    - list of the levels of the tree, from the leaves to the root
+    """
+
+    levels = [list(leaves) or [""]]
+
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([hashlib.blake2b("".join(level[index:index + 2]).encode(), digest_size=16).hexdigest()
+                       for index in range(0, len(level), 2)])
+
+    return levels
+
+
+def diff_tree(local, remote):
+    """
+    Find the blocks whose hashes differ, only the subtrees with a different hash are visited
+
+    Arguments:
+    - local (list): levels of the local tree, see hash_tree
+    - remote (list): levels of the tree of the sheet, with the same number of leaves
+
+    Returns:
+    - sorted list of the indexes of the mismatching blocks
+    """
+
+    nodes = [0]
+
+    for depth in range(len(local) - 1, -1, -1):
+        nodes = [node for node in nodes if local[depth][node] != remote[depth][node]]
+        if depth:
+            width = len(local[depth - 1])
+            nodes = [child for node in nodes for child in (2 * node, 2 * node + 1) if child < width]
+
+    return nodes
+
+
+def read_columns(service, spreadsheet_id, columns=VERIFY_COLUMNS):
+    """
+    Read some columns of the data sheet, without the headers
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - columns (str): letters of the columns, like "ADE"
+
+    Returns:
+    - list of the rows with the values of the columns, in the order of the letters
+    """
+
+    ranges = _column_ranges(columns)
+    response = execute_with_retry(service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[f"data!{value_range.replace(':', '2:')}" for value_range in ranges],
+        majorDimension="ROWS",
+        valueRenderOption="UNFORMATTED_VALUE"
+    ))
+
+    # stitch the ranges back into rows
+    parts = [value_range.get("values", []) for value_range in response["valueRanges"]]
+    widths = [ord(value_range[-1]) - ord(value_range[0]) + 1 for value_range in ranges]
+    rows_count = max((len(part) for part in parts), default=0)
+
+    rows = []
+    for index in range(rows_count):
+        row = []
+        for part, width in zip(parts, widths):
+            cells = part[index] if index < len(part) else []
+            row.extend(_select(cells, range(width)))
+        rows.append(row)
+
+    return rows
+
+
+def verify(service, spreadsheet_id, data, columns=VERIFY_COLUMNS, block_size=BLOCK_SIZE, repair=False):
+    """
+    Compare the data sheet with the local data, reading back only some columns, and optionally
+    rewrite the mismatching blocks. The blocks are compared through merkle trees of their hashes,
+    then the full rows of the mismatching blocks are fetched, so only the rows which differ are written.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - data (list): headers and typed rows, like get_data(file, typed=True)
+    - columns (str): letters of the columns which are compared
+    - block_size (int): number of rows per block
+    - repair (bool): rewrite the rows of the mismatching blocks which differ from the local data
+
+    Returns:
+    - dict with the number of blocks, the indexes of the mismatching blocks and the number of repaired rows
+    """
+
+    indexes = sorted(ord(column) - ord("A") for column in columns.upper())
+    rows = data[1:]
+
+    remote = read_columns(service, spreadsheet_id, columns)
+    local = [_select(row, indexes) for row in rows]
+
+    # the shorter side is padded with empty rows, extra rows of the sheet are drift as well
+    rows_count = max(len(local), len(remote))
+    empty = [""] * len(indexes)
+    local += [empty] * (rows_count - len(local))
+    remote += [empty] * (rows_count - len(remote))
+
+    local_tree = hash_tree(block_hashes(local, block_size))
+    remote_tree = hash_tree(block_hashes(remote, block_size))
+    mismatched = diff_tree(local_tree, remote_tree)
+
+    report = {"blocks": len(local_tree[0]), "mismatched": mismatched, "repaired": 0}
+    if not repair or not mismatched:
+        return report
+
+    # the repaired rows are not those of the manifest of the delta sync
+    forget_manifest(spreadsheet_id)
+
+    # full rows of the mismatching blocks, the first row of the sheet is the headers
+    ranges = [f"data!A{block * block_size + 2}:{chr(ord('A') + len(HEADERS) - 1)}{(block + 1) * block_size + 1}"
+              for block in mismatched]
+    response = execute_with_retry(service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=ranges,
+        majorDimension="ROWS",
+        valueRenderOption="UNFORMATTED_VALUE"
+    ))
+
+    # runs of consecutive rows which differ, as [index of the first row, rows]
+    runs = []
+    for block, value_range in zip(mismatched, response["valueRanges"]):
+        sheet_rows = value_range.get("values", [])
+        start = block * block_size
+
+        for offset in range(block_size):
+            index = start + offset
+            if index >= rows_count:
+                break
+
+            sheet_row = _select(sheet_rows[offset] if offset < len(sheet_rows) else [], range(len(HEADERS)))
+            local_row = _select(rows[index], range(len(HEADERS))) if index < len(rows) else [""] * len(HEADERS)
+            if sheet_row == local_row:
+                continue
+
+            if runs and runs[-1][0] + len(runs[-1][1]) == index:
+                runs[-1][1].append(local_row)
+            else:
+                runs.append([index, [local_row]])
+
+    updates = [{"range": f"data!A{index + 2}", "majorDimension": "ROWS", "values": values} for index, values in runs]
+    if updates:
+        execute_with_retry(service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"valueInputOption": "RAW", "data": updates}
+        ))
+
+    report["repaired"] = sum(len(values) for _, values in runs)
+
+    return report
@@ -0,0 +1,281 @@
+from data_loader import HEADERS, list_files, source_options, map_row, to_values, encode_row, parse_date
+from utils import execute_with_retry, format_requests, pivot_requests, forget_manifest
+from scheduler import PRIORITY_PIVOTS
+from dedup import DEDUP_FILE, DedupIndex, fingerprints
+import metrics
+
+import csv
+import json
+import os
+import re
+import time
+
+
+# offsets of the watched files and number of rows of the sheet, per spreadsheet
+WATCH_FILE = "watch.json"
+
+# seconds between two checks of the files, only a stat of each file when nothing changes
+POLL_INTERVAL = 1.0
+
+# the new rows are sent once the files have been quiet for DEBOUNCE seconds,
+# or MAX_DELAY seconds after the first of them, or when MAX_BATCH rows are waiting
+DEBOUNCE = 2.0
+MAX_DELAY = 10.0
+MAX_BATCH = 5000
+
+
+def load_state(spreadsheet_id, watch_file=WATCH_FILE):
+    """
+    Load the watch state of a spreadsheet
+
+    Arguments:
+    - spreadsheet_id (str): id of the google spreadsheet
+    - watch_file (str): json file of the watch states
+
+    Returns:
+    - dict with the number of rows of the data sheet and the offset and inode of each file
+    """
+
+    state = {"rows": 0, "files": {}}
+
+    if os.path.exists(watch_file):
+        with open(watch_file) as file:
+            state.update(json.load(file).get(spreadsheet_id, {}))
+
+    return state
+
+
+def save_state(spreadsheet_id, state, watch_file=WATCH_FILE):
+    """
+    Save the watch state of a spreadsheet, see load_state
+    """
+
+    states = {}
+    if os.path.exists(watch_file):
+        with open(watch_file) as file:
+            states = json.load(file)
+
+    states[spreadsheet_id] = state
+
+    # the state is replaced at once, a crash never leaves half a file
+    with open(watch_file + ".tmp", "w") as file:
+        json.dump(states, file, indent=2)
+    os.replace(watch_file + ".tmp", watch_file)
+
+
+class Tail():
+    """
+    Follow the lines appended to a csv file from a byte offset. A truncated or replaced file
+    is read again from the start.
+
+    Arguments:
+    - file (str): csv file
+    - options (dict): csv format of the file, see data_loader.source_options
+    - offset (int): bytes already read
+    - inode (int): inode of the file when it was read, None if unknown
+    """
+
+    def __init__(self, file, options, offset=0, inode=None):
+        self.file = file
+        self.options = options
+        self.offset = offset
+        self.inode = inode
+
+        # occurrence numbers of the rows read, see dedup.fingerprints, rebuilt at the first read
+        self.occurrences = None
+
+    def state(self):
+        return {"offset": self.offset, "inode": self.inode}
+
+    def read(self):
+        """
+        Read the complete lines appended since the last read, a line still being written waits for the next one
+
+        Returns:
+        - list of the new rows, converted like get_data
+        """
+
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return []
+
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.offset = 0
+            self.inode = stat.st_ino
+            self.occurrences = {}
+
+        # identical transactions of a day may be split between the reads before a restart and the next ones
+        if self.occurrences is None:
+            self.occurrences = {}
+            with open(self.file, "rb") as file:
+                read = file.read(self.offset).decode().splitlines()[1:]
+            for _ in fingerprints(self._rows(read), self.options["source"], self.occurrences):
+                pass
+
+        if stat.st_size == self.offset:
+            return []
+
+        with open(self.file, "rb") as file:
+            file.seek(self.offset)
+            chunk = file.read(stat.st_size - self.offset)
+
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return []
+
+        lines = chunk[:end + 1].decode().splitlines()
+
+        # skip headers
+        if self.offset == 0:
+            lines = lines[1:]
+
+        self.offset += end + 1
+
+        return self._rows(lines)
+
+    def _rows(self, lines):
+        rows = []
+        for row in csv.reader(lines, delimiter=self.options["delimiter"]):
+            row = [item.strip() for item in row]
+            if not any(row):
+                continue
+
+            rows.append(to_values(map_row(row, self.options)))
+
+        return rows
+
+
+def _last_row(updated_range):
+    # "data!A101:E110" -> 110
+    return int(re.search(r"(\d+)$", updated_range).group(1))
+
+
+def append_rows(service, spreadsheet_id, rows, rows_count):
+    """
+    Append rows at the end of the data sheet and extend the pivot tables to them.
+    The first append of an empty sheet writes the headers and the formatting.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - rows (list): rows like get_data, without the headers
+    - rows_count (int): number of rows of the data sheet, headers included, 0 for an empty sheet
+
+    Returns:
+    - number of rows of the data sheet after the append
+    """
+
+    # the manifest of the delta sync doesn't have the appended rows
+    forget_manifest(spreadsheet_id)
+
+    serials = {}
+    values = [encode_row(row, serials) for row in sorted(rows, key=parse_date)]
+
+    requests = []
+    if rows_count == 0:
+        values.insert(0, HEADERS)
+        requests.extend(format_requests())
+
+    response = execute_with_retry(service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id,
+        range="data!A1",
+        valueInputOption="RAW",
+        insertDataOption="OVERWRITE",
+        body={"majorDimension": "ROWS", "values": values}
+    ))
+
+    # the sheet may have rows the watcher didn't write, the api tells where the rows went
+    rows_count = _last_row(response["updates"]["updatedRange"])
+
+    # the pivot tables only need their source range extended
+    requests.extend(pivot_requests(rows_count))
+    execute_with_retry(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}),
+                       priority=PRIORITY_PIVOTS)
+
+    return rows_count
+
+
+def watch(service, spreadsheet_id, path, sources=None, poll_interval=POLL_INTERVAL, debounce=DEBOUNCE,
+          max_delay=MAX_DELAY, max_batch=MAX_BATCH, watch_file=WATCH_FILE, once=False, dashboard=None,
+          dedup_file=DEDUP_FILE):
+    """
+    Follow a csv file, or the csv files of an inbox directory, and append their new lines to the sheet
+    in micro-batches. Only the appended bytes are parsed, from the offsets saved after each batch,
+    so a restart resumes where the last batch stopped. The transactions already appended, by an older
+    export repeating the same days, are dropped with the persistent dedup index.
+
+    Arguments:
+    - service : google sheets service
+    - spreadsheet_id (str): id of the google spreadsheet
+    - path (str): csv file, directory or glob pattern of the bank exports
+    - sources (dict): csv formats keyed by glob pattern of the file name
+    - poll_interval (float): seconds between two checks of the files
+    - debounce (float): seconds without new lines before a batch is sent
+    - max_delay (float): maximum seconds a row waits before being sent
+    - max_batch (int): number of waiting rows which sends a batch at once
+    - watch_file (str): json file of the watch states
+    - once (bool): send the lines already written and return, instead of watching forever
+    - dashboard (Dashboard): dashboard refreshed with the months of each batch, None to leave it
+    - dedup_file (str): file of the dedup index of the appended transactions, None for an index in memory only
+
+    Returns:
+    - number of appended rows, when once is True
+    """
+
+    state = load_state(spreadsheet_id, watch_file)
+    tails = {}
+    pending = []
+    # fingerprints of the pending rows, added to the index once the rows are in the sheet
+    pending_keys = set()
+    first_read = last_read = None
+    appended = 0
+
+    index = DedupIndex(dedup_file)
+    try:
+        while True:
+            # new files of the inbox
+            for file in list_files(path):
+                if file not in tails:
+                    saved = state["files"].get(file, {})
+                    tails[file] = Tail(file, source_options(file, sources), saved.get("offset", 0),
+                                       saved.get("inode"))
+
+            now = time.monotonic()
+            for tail in tails.values():
+                rows = tail.read()
+                keys = list(fingerprints(rows, tail.options["source"], tail.occurrences))
+                rows = [row for row, key in zip(rows, keys) if key not in index and key not in pending_keys]
+                pending_keys.update(keys)
+
+                if rows:
+                    pending.extend(rows)
+                    last_read = now
+                    first_read = first_read or now
+
+            if pending and (once or len(pending) >= max_batch or now - last_read >= debounce
+                            or now - first_read >= max_delay):
+                with metrics.span("watch.append", rows=len(pending)):
+                    state["rows"] = append_rows(service, spreadsheet_id, pending, state["rows"])
+
+                if dashboard is not None:
+                    dashboard.add(pending)
+                    dashboard.refresh(service)
+
+                # the fingerprints and the offsets are saved once their rows are in the sheet
+                for key in pending_keys:
+                    index.add(key)
+                state["files"] = {file: tail.state() for file, tail in tails.items()}
+                save_state(spreadsheet_id, state, watch_file)
+
+                appended += len(pending)
+                pending = []
+                pending_keys = set()
+                first_read = last_read = None
+
+            if once:
+                return appended
+
+            time.sleep(poll_interval)
+    finally:
+        index.close()